@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import shlex
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from conf import settings
+from utils import run_subprocess
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache:
+    """Package manager caches shared by all builds, bounded in size.
+
+    pip keeps the downloaded and locally built wheels in its cache directory, the
+    wheelhouse holds wheels seeded in advance and npm keeps its tarballs in its own
+    cache, as uv and pnpm do in theirs. In offline mode, installs only use the
+    wheelhouse and the caches.
+    """
+
+    def __init__(
+        self,
+        pip_cache_path: Path,
+        wheelhouse_path: Path,
+        npm_cache_path: Path,
+        uv_cache_path: Path,
+        pnpm_store_path: Path,
+        max_size: int,
+        pip_index_url: Optional[str] = None,
+        npm_registry: Optional[str] = None,
+        offline: bool = False,
+    ):
+        self.pip_cache_path = pip_cache_path
+        self.wheelhouse_path = wheelhouse_path
+        self.npm_cache_path = npm_cache_path
+        self.uv_cache_path = uv_cache_path
+        self.pnpm_store_path = pnpm_store_path
+        self.max_size = max_size
+        self.pip_index_url = pip_index_url
+        self.npm_registry = npm_registry
+        self.offline = offline
+        self.pruned = 0
+        # Size of the caches measured during the last prune
+        self.size = 0
+        self._prune_task: Optional[asyncio.Task] = None
+
+    @property
+    def paths(self) -> List[Path]:
+        return [
+            self.pip_cache_path,
+            self.wheelhouse_path,
+            self.npm_cache_path,
+            self.uv_cache_path,
+            self.pnpm_store_path,
+        ]
+
+    def pip_options(self) -> str:
+        """Options making pip use the shared caches."""
+        self.pip_cache_path.mkdir(parents=True, exist_ok=True)
+        self.wheelhouse_path.mkdir(parents=True, exist_ok=True)
+        options = [
+            f"--cache-dir {str(self.pip_cache_path)}",
+            f"--find-links {str(self.wheelhouse_path)}",
+        ]
+        if self.offline:
+            options.append("--no-index")
+        elif self.pip_index_url:
+            options.append(f"--index-url {self.pip_index_url}")
+        return " ".join(options)
+
+    def npm_options(self) -> str:
+        """Options making npm use the shared cache."""
+        self.npm_cache_path.mkdir(parents=True, exist_ok=True)
+        options = [f"--cache {str(self.npm_cache_path)}"]
+        if self.offline:
+            options.append("--offline")
+        else:
+            options.append("--prefer-offline")
+            if self.npm_registry:
+                options.append(f"--registry {self.npm_registry}")
+        return " ".join(options)
+
+    def uv_options(self) -> str:
+        """Options making uv use its shared cache and the wheelhouse."""
+        self.uv_cache_path.mkdir(parents=True, exist_ok=True)
+        self.wheelhouse_path.mkdir(parents=True, exist_ok=True)
+        options = [
+            f"--cache-dir {str(self.uv_cache_path)}",
+            f"--find-links {str(self.wheelhouse_path)}",
+        ]
+        if self.offline:
+            options.extend(["--no-index", "--offline"])
+        elif self.pip_index_url:
+            options.append(f"--default-index {self.pip_index_url}")
+        return " ".join(options)
+
+    def pnpm_options(self) -> str:
+        """Options making pnpm use its shared content-addressable store."""
+        self.pnpm_store_path.mkdir(parents=True, exist_ok=True)
+        options = [f"--store-dir {str(self.pnpm_store_path)}"]
+        if self.offline:
+            options.append("--offline")
+        else:
+            options.append("--prefer-offline")
+            if self.npm_registry:
+                options.append(f"--registry {self.npm_registry}")
+        return " ".join(options)
+
+    def _files(self) -> List[Path]:
+        files = []
+        for path in self.paths:
+            for root, _, names in os.walk(path):
+                for name in names:
+                    files.append(Path(root, name))
+        return files
+
+    def _prune(self) -> int:
+        """Removes the least recently used files until the caches fit in `max_size`."""
+        files = []
+        for file in self._files():
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, file))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, file in sorted(files):
+            if total <= self.max_size:
+                break
+            file.unlink(missing_ok=True)
+            total -= size
+            removed += size
+        self.size = total
+        return removed
+
+    async def prune(self) -> int:
+        """Prunes the caches in a thread."""
+        start = time.monotonic()
+        removed = await asyncio.get_running_loop().run_in_executor(None, self._prune)
+        if removed:
+            logger.info(
+                f"Pruned {removed} bytes of package caches in {time.monotonic() - start:.1f}s"
+            )
+        self.pruned += removed
+        return removed
+
+    def schedule_prune(self) -> None:
+        """Prunes the caches in the background, unless a prune is already running."""
+        if self._prune_task is None or self._prune_task.done():
+            self._prune_task = asyncio.ensure_future(self.prune())
+
+    async def seed_wheelhouse(self, requirements: List[str]) -> None:
+        """Downloads or builds the wheels of requirements into the wheelhouse."""
+        self.wheelhouse_path.mkdir(parents=True, exist_ok=True)
+        index = (
+            f"--index-url {shlex.quote(self.pip_index_url)}"
+            if self.pip_index_url
+            else ""
+        )
+        await run_subprocess(
+            f"pip wheel --cache-dir {shlex.quote(str(self.pip_cache_path))} {index} "
+            f"--wheel-dir {shlex.quote(str(self.wheelhouse_path))} "
+            f"{' '.join(map(shlex.quote, requirements))}",
+            **settings.phase_limits("install"),
+        )
+
+    async def seed_npm_cache(self, modules: List[str]) -> None:
+        """Adds the tarballs of modules and of their dependencies to the npm cache."""
+        self.npm_cache_path.mkdir(parents=True, exist_ok=True)
+        registry = (
+            f"--registry {shlex.quote(self.npm_registry)}" if self.npm_registry else ""
+        )
+        # `npm cache add` does not follow dependencies, install in a throwaway prefix instead
+        prefix = tempfile.mkdtemp()
+        try:
+            await run_subprocess(
+                f"npm install -g --prefix {shlex.quote(prefix)} "
+                f"--cache {shlex.quote(str(self.npm_cache_path))} "
+                f"{registry} {' '.join(map(shlex.quote, modules))}",
+                **settings.phase_limits("install"),
+            )
+        finally:
+            # The whole installed tree, removed in a thread
+            await asyncio.get_running_loop().run_in_executor(
+                None, shutil.rmtree, prefix, True
+            )
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "max_size": self.max_size, "pruned": self.pruned}
+
+
+artifact_cache = ArtifactCache(
+    pip_cache_path=settings.PIP_CACHE_PATH,
+    wheelhouse_path=settings.WHEELHOUSE_PATH,
+    npm_cache_path=settings.NPM_CACHE_PATH,
+    uv_cache_path=settings.UV_CACHE_PATH,
+    pnpm_store_path=settings.PNPM_STORE_PATH,
+    max_size=settings.ARTIFACT_CACHE_MAX_SIZE,
+    pip_index_url=settings.PIP_INDEX_URL,
+    npm_registry=settings.NPM_REGISTRY,
+    offline=settings.OFFLINE_INSTALLS,
+)
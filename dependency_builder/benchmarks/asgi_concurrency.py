@@ -0,0 +1,106 @@
+"""
+Measures the throughput of init1.py running the requests of an ASGI program, one at a
+time as before and concurrently, and checks that the output of every request is its own.
+
+The program prints, waits for `--latency` as if it called another service, and prints
+again on stderr. Instructions are processed as the supervisor sends them, reports the
+requests per second and the requests with the output of another one, as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.asgi_concurrency --output asgi_concurrency.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import msgpack
+
+import init1
+
+
+def make_app(latency: float):
+    async def app(scope, receive, send):
+        request_id = (await receive())["body"].decode()
+        print(f"start {request_id}")
+        await asyncio.sleep(latency)
+        print(f"end {request_id}", file=sys.stderr)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": request_id.encode()})
+
+    return app
+
+
+async def request(app, request_id: str, slots: asyncio.Semaphore) -> bool:
+    """Runs a request, returns whether its output is its own."""
+    instruction = msgpack.dumps(
+        {
+            "scope": {
+                "type": "http",
+                "method": "GET",
+                "path": "/",
+                "headers": [],
+                "body": request_id.encode(),
+            }
+        }
+    )
+    async for message in init1.process_instruction(
+        instruction, init1.Interface.asgi, app, request_slots=slots
+    ):
+        result = msgpack.loads(b"".join(bytes(piece) for piece in message))
+    return result["output"] == f"start {request_id}\nend {request_id}\n"
+
+
+async def benchmark(requests: int, concurrency: int, latency: float) -> List[dict]:
+    init1.capture_request_output()
+    app = make_app(latency)
+    results = []
+    for limit in (1, concurrency):
+        slots = asyncio.Semaphore(limit)
+        start = time.perf_counter()
+        own = await asyncio.gather(
+            *(request(app, str(index), slots) for index in range(requests))
+        )
+        duration = time.perf_counter() - start
+        results.append(
+            {
+                "concurrency": limit,
+                "requests_per_second": round(requests / duration, 1),
+                "misattributed": own.count(False),
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--concurrency", type=int, default=init1.MAX_CONCURRENT_REQUESTS
+    )
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds")
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+    logging.disable(logging.DEBUG)
+
+    results = asyncio.run(benchmark(args.requests, args.concurrency, args.latency))
+
+    for result in results:
+        print(
+            f"x{result['concurrency']:<4} {result['requests_per_second']:8.1f} req/s"
+            f" {result['misattributed']} misattributed",
+            file=sys.stderr,
+        )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
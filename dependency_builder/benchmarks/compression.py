@@ -0,0 +1,118 @@
+"""
+Compares the squashfs compression profiles on representative Python and Node.js volumes.
+
+Reports the image size, the squash time and the cold read time (extracting the whole
+image after dropping the page cache, when allowed) of every profile, as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.compression --output compression.json
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from squashfs import COMPRESSION_PROFILES, mksquashfs_command
+
+DEFAULT_PYTHON_REQUIREMENTS = ["fastapi", "uvicorn", "numpy", "pandas"]
+DEFAULT_NODE_MODULES = ["express", "lodash", "typescript"]
+
+
+def run(cmd: str) -> float:
+    """Runs a shell command and returns its duration in seconds."""
+    start = time.perf_counter()
+    subprocess.run(cmd, shell=True, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def drop_caches() -> bool:
+    try:
+        subprocess.run("sync", check=True)
+        Path("/proc/sys/vm/drop_caches").write_text("3\n")
+        return True
+    except OSError:
+        return False
+
+
+def prepare_trees(
+    workdir: Path, requirements: List[str], modules: List[str]
+) -> Dict[str, Path]:
+    trees = {}
+    if requirements:
+        trees["python"] = workdir / "python"
+        run(f"pip install -q -t {trees['python']} {' '.join(requirements)}")
+    if modules:
+        prefix = workdir / "node"
+        run(f"npm install -s -g --prefix {prefix} {' '.join(modules)}")
+        trees["nodejs"] = prefix / "lib" / "node_modules"
+    return trees
+
+
+def benchmark(name: str, tree: Path, workdir: Path) -> List[dict]:
+    results = []
+    for compression in COMPRESSION_PROFILES:
+        image = workdir / f"{name}-{compression.value}.squashfs"
+        squash_time = run(mksquashfs_command(tree, image, compression) + " -quiet")
+        cold = drop_caches()
+        extracted = workdir / "extracted"
+        read_time = run(f"unsquashfs -q -n -d {extracted} {image}")
+        shutil.rmtree(extracted)
+        results.append(
+            {
+                "tree": name,
+                "profile": compression.value,
+                "size": image.stat().st_size,
+                "squash_time": round(squash_time, 3),
+                "read_time": round(read_time, 3),
+                "cold_read": cold,
+            }
+        )
+        image.unlink()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--python", nargs="*", default=DEFAULT_PYTHON_REQUIREMENTS)
+    parser.add_argument("--node", nargs="*", default=DEFAULT_NODE_MODULES)
+    parser.add_argument(
+        "--tree",
+        nargs="*",
+        type=Path,
+        default=[],
+        help="Existing directories to benchmark instead of installing packages",
+    )
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        if args.tree:
+            trees = {tree.name: tree for tree in args.tree}
+        else:
+            trees = prepare_trees(workdir, args.python, args.node)
+
+        results = []
+        for name, tree in trees.items():
+            results.extend(benchmark(name, tree, workdir))
+
+    for result in results:
+        print(
+            f"{result['tree']:<10} {result['profile']:<14} {result['size'] / 1024**2:8.1f} MiB"
+            f" squash {result['squash_time']:7.2f}s read {result['read_time']:7.2f}s",
+            file=sys.stderr,
+        )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
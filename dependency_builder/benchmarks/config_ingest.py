@@ -0,0 +1,130 @@
+"""
+Measures how long the VM init takes to receive its configuration at boot, with code and
+input data of 1, 10 and 100 MB, with the framed receiver of init1.py and with the
+previous receiver, that read the length prefix byte by byte and concatenated the chunks.
+
+The configuration is sent by a thread over a socket pair, as the supervisor does over
+vsock. Reports the median receive time and the peak memory allocated, as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.config_ingest --output config_ingest.json
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+import msgpack
+
+import init1
+
+DEFAULT_SIZES = [1, 10, 100]  # MB
+
+
+def legacy_receive_config(client) -> init1.ConfigurationPayload:
+    """Receiver of init1.py before the framed one.
+
+    It read at most 9 bytes of length prefix, and thus failed on configurations of
+    100 MB and more, one more byte is read here to compare them.
+    """
+    buffer = b""
+    for _ in range(init1.LENGTH_HEADER_SIZE):
+        byte = client.recv(1)
+        if byte == b"\n":
+            break
+        else:
+            buffer += byte
+    length = int(buffer)
+    data = b""
+    while len(data) < length:
+        data += client.recv(1024 * 1024)
+    return init1.load_configuration(data)
+
+
+RECEIVERS = {"legacy": legacy_receive_config, "framed": init1.receive_config}
+
+
+def make_config(size: int) -> bytes:
+    """A configuration with code and input data of `size` bytes each, length-prefixed."""
+    payload = msgpack.dumps(
+        {
+            "input_data": os.urandom(size),
+            "interface": "asgi",
+            "vm_hash": "0" * 64,
+            "code": os.urandom(size),
+            "encoding": "zip",
+            "entrypoint": "main:app",
+            "volumes": [],
+        },
+        use_bin_type=True,
+    )
+    return f"{len(payload)}\n".encode() + payload
+
+
+def receive(receiver: Callable, config: bytes, trace: bool) -> float:
+    """Duration of the receive of a configuration, in seconds."""
+    host, guest = socket.socketpair()
+    sender = threading.Thread(target=host.sendall, args=(config,))
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    sender.start()
+    receiver(guest)
+    duration = time.perf_counter() - start
+    sender.join()
+    host.close()
+    guest.close()
+    return duration
+
+
+def benchmark(name: str, size: int, runs: int) -> dict:
+    receiver = RECEIVERS[name]
+    config = make_config(size * 1024**2)
+    durations = [receive(receiver, config, trace=False) for _ in range(runs)]
+    receive(receiver, config, trace=True)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "receiver": name,
+        "size_mb": size,
+        "median": round(statistics.median(durations), 4),
+        "peak_memory": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="*", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+    logging.disable(logging.DEBUG)
+
+    results: List[dict] = []
+    for size in args.sizes:
+        for name in RECEIVERS:
+            results.append(benchmark(name, size, args.runs))
+
+    for result in results:
+        print(
+            f"{result['receiver']:<7} {result['size_mb']:4} MB {result['median']:8.4f}s"
+            f" peak {result['peak_memory'] / 1024**2:8.1f} MiB",
+            file=sys.stderr,
+        )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures the latency that init1.py adds to the requests of executable programs, with a
+session and a connection per request as before, and with the persistent session.
+
+A small aiohttp server stands in for the program. Requests are sent one at a time and
+then `--concurrency` at a time, reports the p50/p99 latencies of each as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.executable_http --output executable_http.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+import aiohttp
+from aiohttp import web
+
+import init1
+
+SCOPE = {"method": "GET", "path": "/", "query_string": "", "headers": []}
+
+
+async def legacy_request(scope: dict) -> None:
+    """Request of init1.py before the persistent session."""
+    timeout = aiohttp.ClientTimeout(total=5)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await init1.make_request(session, dict(scope))
+
+
+async def measure(
+    request: Callable[[dict], Awaitable[None]], requests: int, concurrency: int
+) -> dict:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await request(SCOPE)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    latencies.sort()
+    return {
+        "p50": round(statistics.median(latencies) * 1000, 3),
+        "p99": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+async def hello(request: web.Request) -> web.Response:
+    return web.Response(text="Hello")
+
+
+async def benchmark(requests: int, concurrency: int) -> List[dict]:
+    app = web.Application()
+    app.router.add_get("/", hello)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    init1.APP_URL = f"http://127.0.0.1:{port}"
+
+    session = init1.HTTPClientSettings().session()
+
+    async def persistent_request(scope: dict) -> None:
+        await init1.run_executable_http(dict(scope), session)
+
+    results = []
+    try:
+        for name, request in (
+            ("per-request", legacy_request),
+            ("persistent", persistent_request),
+        ):
+            for level in (1, concurrency):
+                results.append(
+                    {
+                        "session": name,
+                        "concurrency": level,
+                        **await measure(request, requests, level),
+                    }
+                )
+    finally:
+        await session.close()
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+    logging.disable(logging.DEBUG)
+
+    results = asyncio.run(benchmark(args.requests, args.concurrency))
+
+    for result in results:
+        print(
+            f"{result['session']:<12} x{result['concurrency']:<3}"
+            f" p50 {result['p50']:7.3f}ms p99 {result['p99']:7.3f}ms",
+            file=sys.stderr,
+        )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Stand-ins for pip, npm, pipenv, poetry and mksquashfs, used to benchmark the build
+pipeline without network access. Called as `python fake_tools.py <tool> <args...>`.
+
+Every package installed takes FAKE_INSTALL_SECONDS and FAKE_PACKAGE_BYTES on disk,
+and squashing goes at FAKE_SQUASH_RATE bytes per second.
+"""
+import json
+import os
+import sys
+import tarfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+INSTALL_SECONDS = float(os.environ.get("FAKE_INSTALL_SECONDS", "0.05"))
+PACKAGE_BYTES = int(os.environ.get("FAKE_PACKAGE_BYTES", str(256 * 1024)))
+SQUASH_RATE = float(os.environ.get("FAKE_SQUASH_RATE", str(200 * 1024**2)))
+
+# Options followed by a value, for each tool
+VALUE_OPTIONS = {
+    "pip": {"-t", "-r", "--cache-dir", "--find-links", "--index-url", "--wheel-dir"},
+    "npm": {"--prefix", "--cache", "--registry"},
+}
+
+
+def parse(tool: str, args: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    options, positional = {}, []
+    args = iter(args)
+    for arg in args:
+        if arg in VALUE_OPTIONS[tool]:
+            options[arg] = next(args)
+        elif arg.startswith("-"):
+            options[arg] = ""
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+def install_packages(destination: Path, names: List[str]) -> None:
+    for name in names:
+        package = destination / name
+        package.mkdir(parents=True, exist_ok=True)
+        (package / "__init__.py").write_bytes(os.urandom(PACKAGE_BYTES))
+    time.sleep(INSTALL_SECONDS * len(names))
+
+
+def package_name(spec: str) -> str:
+    for separator in ("==", ">=", "<=", "~=", "@", "<", ">"):
+        spec = spec.split(separator, 1)[0] or spec
+    return spec.strip().lower()
+
+
+def pip(args: List[str]) -> None:
+    options, positional = parse("pip", args[1:])
+    requirements = positional
+    if "-r" in options:
+        lines = Path(options["-r"]).read_text().splitlines()
+        requirements += [line for line in lines if line and not line.startswith("#")]
+    destination = Path(options.get("-t") or options.get("--wheel-dir") or ".")
+    install_packages(destination, [package_name(spec) for spec in requirements])
+
+
+def npm(args: List[str]) -> None:
+    options, positional = parse("npm", args[1:])
+    if "-g" in options:
+        destination = Path(options.get("--prefix", "/usr/local")) / "lib"
+        modules = positional
+    else:
+        package = json.loads(Path("package.json").read_text())
+        destination = Path(".")
+        modules = list(package.get("dependencies", {}))
+    install_packages(destination / "node_modules", [package_name(m) for m in modules])
+
+
+def pipenv(args: List[str]) -> None:
+    if args[0] == "requirements":
+        print("fastapi==0.96.0\nuvicorn==0.22.0")
+
+
+def poetry(args: List[str]) -> None:
+    output = Path(args[args.index("-o") + 1])
+    output.write_text("fastapi==0.96.0\nuvicorn==0.22.0\n")
+
+
+def mksquashfs(args: List[str]) -> None:
+    source, destination = Path(args[0]), Path(args[1])
+    with tarfile.open(destination, "w") as tar:
+        tar.add(source, arcname=".")
+    time.sleep(destination.stat().st_size / SQUASH_RATE)
+
+
+TOOLS = {
+    "pip": pip,
+    "npm": npm,
+    "pipenv": pipenv,
+    "poetry": poetry,
+    "mksquashfs": mksquashfs,
+}
+
+if __name__ == "__main__":
+    TOOLS[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,123 @@
+"""
+Measures the import time of common Python stacks from a read-only volume, as in the
+VMs, with the bytecode compiled by pip and with the bytecode precompiled by the builder.
+
+Imports run in fresh `python -OO` interpreters, as init1.py does, that cannot write the
+bytecode they compile. Reports the median import time of every stack, as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.imports --output imports.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from bytecode import compile_bytecode_command, remove_bytecode
+from conf import settings
+
+DEFAULT_STACKS = {
+    "fastapi": ["fastapi", "uvicorn"],
+    "requests": ["requests"],
+    "pandas": ["pandas"],
+    "aleph": ["aleph-sdk-python"],
+}
+# Module imported to measure each stack, defaults to the stack name
+STACK_MODULES = {"aleph": "aleph.sdk"}
+# How the volume is compiled before squashing, by the name of the variant
+VARIANTS = ["pip", "precompiled"]
+# Interpreter flags, by optimization level
+LEVELS = {"O0": [], "OO": ["-OO"]}
+
+
+def import_time(python: str, tree: Path, module: str, flags: List[str]) -> float:
+    """Duration of the import of a module in a fresh interpreter, in seconds."""
+    env = {**os.environ, "PYTHONPATH": str(tree), "PYTHONDONTWRITEBYTECODE": "1"}
+    start = time.perf_counter()
+    subprocess.run([python, *flags, "-c", f"import {module}"], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def prepare_tree(python: str, tree: Path, packages: List[str], variant: str) -> None:
+    subprocess.run(
+        [python, "-m", "pip", "install", "-q", "-t", str(tree), *packages], check=True
+    )
+    if variant == "precompiled":
+        remove_bytecode(tree)
+        subprocess.run(
+            compile_bytecode_command(
+                tree, tree, python, settings.BYTECODE_OPTIMIZATION_LEVELS
+            ),
+            shell=True,
+            check=True,
+        )
+
+
+def benchmark(
+    python: str, name: str, packages: List[str], workdir: Path, repeat: int
+) -> List[dict]:
+    module = STACK_MODULES.get(name, name)
+    results = []
+    for variant in VARIANTS:
+        tree = workdir / f"{name}-{variant}"
+        prepare_tree(python, tree, packages, variant)
+        result: Dict = {"stack": name, "variant": variant}
+        for level, flags in LEVELS.items():
+            # The first import warms the page cache, as a second boot of the VM would
+            import_time(python, tree, module, flags)
+            times = [import_time(python, tree, module, flags) for _ in range(repeat)]
+            result[f"import_time_{level}"] = round(statistics.median(times), 4)
+        results.append(result)
+        shutil.rmtree(tree)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--stack",
+        nargs="*",
+        default=list(DEFAULT_STACKS),
+        help=f"Stacks to benchmark, among {', '.join(DEFAULT_STACKS)}",
+    )
+    parser.add_argument(
+        "--python",
+        default=sys.executable,
+        help="Interpreter of the VMs, to compile the bytecode and import with",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for name in args.stack:
+            results.extend(
+                benchmark(
+                    args.python, name, DEFAULT_STACKS[name], Path(tmp), args.repeat
+                )
+            )
+
+    for result in results:
+        print(
+            f"{result['stack']:<10} {result['variant']:<12}"
+            f" python {result['import_time_O0']:7.3f}s"
+            f" python -OO {result['import_time_OO']:7.3f}s",
+            file=sys.stderr,
+        )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
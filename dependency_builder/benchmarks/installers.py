@@ -0,0 +1,150 @@
+"""
+Compares the installer backends of the builder: pip and uv for Python, npm and pnpm for
+Node.js, with cold and warm caches.
+
+Python packages are installed from a local index, a wheelhouse downloaded once before
+the runs, so that the network does not weigh on the results. Node.js modules are only
+installed with `--npm-registry`, from a local mirror of the registry. Backends that are
+not installed are skipped. Reports the median install time of every backend, as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.installers --output installers.json
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from installers import PNPM_LAYOUT_OPTIONS
+
+DEFAULT_PYTHON_REQUIREMENTS = ["fastapi", "uvicorn", "pandas", "aleph-sdk-python"]
+DEFAULT_NODE_MODULES = ["express", "lodash", "typescript"]
+
+
+def run(cmd: str) -> float:
+    """Runs a shell command and returns its duration in seconds."""
+    start = time.perf_counter()
+    subprocess.run(
+        cmd, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    return time.perf_counter() - start
+
+
+def python_commands(wheelhouse: Path, requirements: List[str]) -> dict:
+    """Install commands of the Python backends, by name, of a cache and a target."""
+    index = f"--no-index --find-links {wheelhouse}"
+    packages = " ".join(requirements)
+    return {
+        "pip": lambda cache, target: (
+            f"{sys.executable} -m pip install -q --cache-dir {cache} {index} "
+            f"-t {target} {packages}"
+        ),
+        "uv": lambda cache, target: (
+            f"uv pip install -q --cache-dir {cache} {index} --python {sys.executable} "
+            f"--compile-bytecode --target {target} {packages}"
+        ),
+    }
+
+
+def node_commands(registry: str, modules: List[str]) -> dict:
+    """Install commands of the Node.js backends, by name, of a cache and a target."""
+    packages = " ".join(modules)
+    return {
+        "npm": lambda cache, target: (
+            f"npm install -s --cache {cache} --registry {registry} -g "
+            f"--prefix {target} {packages}"
+        ),
+        "pnpm": lambda cache, target: (
+            f"mkdir -p {target} && pnpm add -s --store-dir {cache} --registry {registry} "
+            f"{PNPM_LAYOUT_OPTIONS} --dir {target} {packages}"
+        ),
+    }
+
+
+def benchmark(
+    ecosystem: str,
+    name: str,
+    command: Callable[[Path, Path], str],
+    workdir: Path,
+    runs: int,
+) -> Optional[List[dict]]:
+    if shutil.which(name) is None:
+        print(f"{name} is not installed, skipped", file=sys.stderr)
+        return None
+    cache = workdir / f"{name}-cache"
+    target = workdir / f"{name}-target"
+    durations = {"cold": [], "warm": []}
+    for _ in range(runs):
+        shutil.rmtree(cache, ignore_errors=True)
+        for state in ("cold", "warm"):
+            shutil.rmtree(target, ignore_errors=True)
+            durations[state].append(run(command(cache, target)))
+    shutil.rmtree(cache, ignore_errors=True)
+    shutil.rmtree(target, ignore_errors=True)
+    return [
+        {
+            "ecosystem": ecosystem,
+            "installer": name,
+            "cache": state,
+            "median": round(statistics.median(values), 3),
+            "runs": [round(value, 3) for value in values],
+        }
+        for state, values in durations.items()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--python", nargs="*", default=DEFAULT_PYTHON_REQUIREMENTS)
+    parser.add_argument("--node", nargs="*", default=DEFAULT_NODE_MODULES)
+    parser.add_argument(
+        "--npm-registry", help="Local npm registry to install the Node.js modules from"
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        benchmarks = []
+        if args.python:
+            wheelhouse = workdir / "wheelhouse"
+            run(
+                f"{sys.executable} -m pip download -q -d {wheelhouse} {' '.join(args.python)}"
+            )
+            commands = python_commands(wheelhouse, args.python)
+            benchmarks.extend(
+                ("python", name, command) for name, command in commands.items()
+            )
+        if args.node and args.npm_registry:
+            commands = node_commands(args.npm_registry, args.node)
+            benchmarks.extend(
+                ("nodejs", name, command) for name, command in commands.items()
+            )
+        for ecosystem, name, command in benchmarks:
+            results.extend(
+                benchmark(ecosystem, name, command, workdir, args.runs) or []
+            )
+
+    for result in results:
+        print(
+            f"{result['ecosystem']:<8} {result['installer']:<6} {result['cache']:<5}"
+            f" {result['median']:7.2f}s",
+            file=sys.stderr,
+        )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
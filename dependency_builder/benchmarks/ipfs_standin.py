@@ -0,0 +1,121 @@
+"""
+Minimal in-memory implementation of the IPFS HTTP API endpoints used by the builder.
+
+Added files get the CID `ipfs add` would give them, files written through MFS get a
+SHA-256 based identifier instead. Uploads can be throttled to simulate the bandwidth
+to a remote node.
+
+Run standalone with:
+    python -m benchmarks.ipfs_standin --port 5001
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from unixfs import stream_cid
+
+
+class IPFSStandIn:
+    def __init__(self, upload_rate: Optional[float] = None):
+        # In bytes per second, unlimited if None
+        self.upload_rate = upload_rate
+        self.pins: Dict[str, int] = {}
+        self.mfs: Dict[str, bytearray] = {}
+        self.uploaded_bytes = 0
+
+    @staticmethod
+    def cid(data: bytes) -> str:
+        return "Qm" + hashlib.sha256(data).hexdigest()[:44]
+
+    @staticmethod
+    def add_cid(data: bytes) -> str:
+        return stream_cid(io.BytesIO(data))
+
+    async def throttle(self, size: int) -> None:
+        self.uploaded_bytes += size
+        if self.upload_rate:
+            await asyncio.sleep(size / self.upload_rate)
+
+    async def add(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        lines = []
+        async for part in reader:
+            data = await part.read()
+            await self.throttle(len(data))
+            cid = self.add_cid(data)
+            self.pins[cid] = len(data)
+            lines.append(json.dumps({"Name": part.filename, "Hash": cid}))
+        return web.Response(text="\n".join(lines) + "\n")
+
+    async def pin_ls(self, request: web.Request) -> web.Response:
+        cid = request.query.get("arg")
+        if cid not in self.pins:
+            return web.json_response(
+                {"Message": f"path '{cid}' is not pinned", "Code": 0, "Type": "error"},
+                status=500,
+            )
+        return web.json_response({"Keys": {cid: {"Type": "recursive"}}})
+
+    async def pin_add(self, request: web.Request) -> web.Response:
+        cid = request.query["arg"]
+        self.pins.setdefault(cid, 0)
+        return web.json_response({"Pins": [cid]})
+
+    async def files_write(self, request: web.Request) -> web.Response:
+        path = request.query["arg"]
+        offset = int(request.query.get("offset", 0))
+        reader = await request.multipart()
+        part = await reader.next()
+        data = await part.read()
+        await self.throttle(len(data))
+        content = self.mfs.setdefault(path, bytearray())
+        if len(content) < offset:
+            content.extend(b"\0" * (offset - len(content)))
+        content[offset : offset + len(data)] = data
+        return web.Response(text="")
+
+    async def files_stat(self, request: web.Request) -> web.Response:
+        content = self.mfs[request.query["arg"]]
+        return web.json_response(
+            {"Hash": self.cid(bytes(content)), "Size": len(content), "Type": "file"}
+        )
+
+    async def files_rm(self, request: web.Request) -> web.Response:
+        self.mfs.pop(request.query["arg"], None)
+        return web.json_response({})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=0)
+        for path, handler in (
+            ("/api/v0/add", self.add),
+            ("/api/v0/pin/ls", self.pin_ls),
+            ("/api/v0/pin/add", self.pin_add),
+            ("/api/v0/files/write", self.files_write),
+            ("/api/v0/files/stat", self.files_stat),
+            ("/api/v0/files/rm", self.files_rm),
+        ):
+            app.router.add_route("*", path, handler)
+        return app
+
+    async def start(self, port: int) -> web.AppRunner:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--upload-rate", type=float, help="In bytes per second")
+    args = parser.parse_args()
+    web.run_app(IPFSStandIn(args.upload_rate).app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
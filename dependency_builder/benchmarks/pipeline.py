@@ -0,0 +1,294 @@
+"""
+Benchmarks the whole build pipeline under load, without network access.
+
+The API is served in-process with fake package managers and mksquashfs (see
+`fake_tools.py`) and an in-memory IPFS node (see `ipfs_standin.py`), then receives a
+mix of requests at a given concurrency:
+- small: short lists of new Python requirements
+- large: package.json files with many new dependencies
+- duplicate: the same list of requirements every time, served by coalescing or cache
+
+Reports the p50/p99 latency of each kind of request, the builds per minute and the
+peak disk and memory usage, as JSON.
+
+Run from the dependency_builder directory:
+    python -m benchmarks.pipeline --requests 200 --concurrency 16 --output pipeline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import aiohttp
+
+from benchmarks.ipfs_standin import IPFSStandIn
+
+FAKE_TOOLS = ["pip", "npm", "pipenv", "poetry", "mksquashfs"]
+API_PORT = 18000
+IPFS_PORT = 15001
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for item in value.split(","):
+        kind, weight = item.split("=")
+        if kind not in ("small", "large", "duplicate"):
+            raise argparse.ArgumentTypeError(f"Unknown kind of request: {kind}")
+        mix[kind] = int(weight)
+    return mix
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return round(ordered[rank], 4)
+
+
+def install_fake_tools(bin_path: Path) -> None:
+    """Puts the fake tools ahead of the real ones in the PATH."""
+    bin_path.mkdir()
+    fake_tools = Path(__file__).parent / "fake_tools.py"
+    for tool in FAKE_TOOLS:
+        script = bin_path / tool
+        script.write_text(
+            f'#!/bin/sh\nexec {sys.executable} {fake_tools} {tool} "$@"\n'
+        )
+        script.chmod(0o755)
+    os.environ["PATH"] = f"{bin_path}:{os.environ['PATH']}"
+
+
+def configure(workdir: Path, args: argparse.Namespace) -> None:
+    """Points the builder to the temporary directory, must run before importing it."""
+    os.environ.update(
+        {
+            "BUILDER_WORKSPACES_PATH": str(workdir / "builds"),
+            "BUILDER_BUILD_CACHE_PATH": str(workdir / "builds.sqlite3"),
+            "BUILDER_PIP_CACHE_PATH": str(workdir / "pip"),
+            "BUILDER_WHEELHOUSE_PATH": str(workdir / "wheelhouse"),
+            "BUILDER_NPM_CACHE_PATH": str(workdir / "npm"),
+            "BUILDER_UV_CACHE_PATH": str(workdir / "uv"),
+            "BUILDER_PNPM_STORE_PATH": str(workdir / "pnpm"),
+            "BUILDER_IPFS_MULTIADDRS": json.dumps(
+                [f"/ip4/127.0.0.1/tcp/{IPFS_PORT}/http"]
+            ),
+            "BUILDER_MAX_CONCURRENT_BUILDS": str(args.max_concurrent_builds),
+            "BUILDER_MAX_QUEUED_BUILDS": str(args.requests),
+            "BUILDER_STREAM_UPLOADS": str(args.stream_uploads),
+            "FAKE_INSTALL_SECONDS": str(args.install_seconds),
+            "FAKE_PACKAGE_BYTES": str(args.package_bytes),
+        }
+    )
+
+
+def make_workload(args: argparse.Namespace) -> List[str]:
+    rng = random.Random(args.seed)
+    kinds = list(args.mix)
+    weights = [args.mix[kind] for kind in kinds]
+    return rng.choices(kinds, weights, k=args.requests)
+
+
+async def send(
+    session: aiohttp.ClientSession, kind: str, args: argparse.Namespace
+) -> bool:
+    url = f"http://127.0.0.1:{API_PORT}"
+    if kind == "small":
+        requirements = [f"pkg-{uuid.uuid4().hex}" for _ in range(args.small_size)]
+        request = session.post(f"{url}/build/python3.9", json=requirements)
+    elif kind == "large":
+        package = {
+            "name": "benchmark",
+            "dependencies": {
+                f"module-{uuid.uuid4().hex}": "^1.0.0" for _ in range(args.large_size)
+            },
+        }
+        data = aiohttp.FormData()
+        data.add_field("data_file", json.dumps(package), filename="package.json")
+        request = session.post(f"{url}/build/nodejs/package", data=data)
+    else:
+        requirements = [f"duplicate-{i}" for i in range(args.small_size)]
+        request = session.post(f"{url}/build/python3.9", json=requirements)
+    async with request as response:
+        await response.read()
+        return response.status == 200
+
+
+def disk_usage(path: Path) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def tree_rss() -> int:
+    """Resident memory of this process and of all its descendants, from /proc."""
+    parents, rss = {}, {}
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The command name may contain spaces, the fields after it do not
+            fields = stat_path.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        pid = int(stat_path.parent.name)
+        parents[pid] = int(fields[1])
+        rss[pid] = int(fields[21]) * resource.getpagesize()
+    tree, total = {os.getpid()}, 0
+    for pid in sorted(parents):
+        if pid in tree or parents[pid] in tree:
+            tree.add(pid)
+            total += rss[pid]
+    return total
+
+
+async def sample_usage(path: Path, peak: Dict[str, int]) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        disk = await loop.run_in_executor(None, disk_usage, path)
+        peak["disk"] = max(peak["disk"], disk)
+        peak["rss"] = max(peak["rss"], await loop.run_in_executor(None, tree_rss))
+        await asyncio.sleep(0.1)
+
+
+async def run_workload(
+    workload: List[str], args: argparse.Namespace, workspaces_path: Path
+) -> Tuple[Dict[str, List[float]], int, float, Dict[str, int]]:
+    latencies: Dict[str, List[float]] = {kind: [] for kind in args.mix}
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=None)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+
+        async def timed(kind: str) -> None:
+            nonlocal errors
+            async with semaphore:
+                start = time.monotonic()
+                if await send(session, kind, args):
+                    latencies[kind].append(time.monotonic() - start)
+                else:
+                    errors += 1
+
+        peak = {"disk": 0, "rss": 0}
+        sampler = asyncio.ensure_future(sample_usage(workspaces_path, peak))
+        start = time.monotonic()
+        await asyncio.gather(*(timed(kind) for kind in workload))
+        duration = time.monotonic() - start
+        sampler.cancel()
+    return latencies, errors, duration, peak
+
+
+async def benchmark(args: argparse.Namespace, workdir: Path) -> dict:
+    import uvicorn
+
+    import main
+
+    ipfs = IPFSStandIn(args.upload_rate)
+    ipfs_runner = await ipfs.start(IPFS_PORT)
+    server = uvicorn.Server(
+        uvicorn.Config(
+            main.http_app, host="127.0.0.1", port=API_PORT, log_level="error"
+        )
+    )
+    serving = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        latencies, errors, duration, peak = await run_workload(
+            make_workload(args), args, workdir / "builds"
+        )
+    finally:
+        server.should_exit = True
+        await serving
+        await ipfs_runner.cleanup()
+
+    succeeded = sum(len(values) for values in latencies.values())
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "duration": round(duration, 3),
+        "builds_per_minute": round(succeeded / duration * 60, 2),
+        "volumes_uploaded": len(ipfs.pins),
+        "uploaded_bytes": ipfs.uploaded_bytes,
+        "latency": {
+            "all": {
+                "p50": percentile(all_latencies, 50),
+                "p99": percentile(all_latencies, 99),
+            },
+            **{
+                kind: {"p50": percentile(values, 50), "p99": percentile(values, 99)}
+                for kind, values in latencies.items()
+            },
+        },
+        "peak_disk_bytes": peak["disk"],
+        # Sampled every 0.1s, including the package managers and mksquashfs
+        "peak_rss_bytes": peak["rss"],
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="small=6,large=2,duplicate=2",
+        help="Relative weights of the kinds of requests",
+    )
+    parser.add_argument("--small-size", type=int, default=5, help="Requirements")
+    parser.add_argument("--large-size", type=int, default=100, help="Dependencies")
+    parser.add_argument("--max-concurrent-builds", type=int, default=os.cpu_count())
+    parser.add_argument("--stream-uploads", action="store_true")
+    parser.add_argument("--install-seconds", type=float, default=0.01)
+    parser.add_argument("--package-bytes", type=int, default=64 * 1024)
+    parser.add_argument(
+        "--upload-rate", type=float, help="IPFS upload rate in bytes per second"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        install_fake_tools(workdir / "bin")
+        configure(workdir, args)
+        results = asyncio.run(benchmark(args, workdir))
+
+    config = {name: value for name, value in vars(args).items() if name != "output"}
+    output = json.dumps(
+        {"commit": git_commit(), "config": config, "results": results}, indent=2
+    )
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,159 +1,823 @@
 import asyncio
+import json
+import logging
+import shlex
 import shutil
 import subprocess
+import time
+from dataclasses import asdict, dataclass
+from enum import Enum
 from pathlib import Path
-from typing import List
+from typing import Awaitable, Callable, Dict, List, Optional
 
 from fastapi import HTTPException
 
-from utils import CID, make_dependencies_hash, run_subprocess, upload_sources
+from artifacts import artifact_cache
+from bytecode import compile_bytecode_command, remove_bytecode
+from cache import build_cache, in_flight_builds, lockfile_cache
+from conf import settings
+from installers import (
+    NodeInstaller,
+    UvPythonInstaller,
+    node_installer,
+    python_installer,
+    requirement_arguments,
+)
+from ipfs import ipfs_pool, stream_sources, upload_sources
+from layers import package_store
+from manifests import (
+    normalize_modules,
+    normalize_package_json,
+    normalize_pipfile,
+    normalize_pyproject,
+    normalize_requirements,
+    parse_json,
+    pipfile_lock_requirements,
+    reduce_package_json,
+    requirement_lines,
+    resolved_node_modules,
+)
+from metrics import (
+    BUILD_DURATION,
+    PRUNED_BYTES,
+    SKIPPED_UPLOADS,
+    UPLOADED_BYTES,
+    VOLUME_SIZE,
+    measure_installer,
+    measure_phase,
+)
+from pruning import Pruning, prune
+from reproducible import normalize_timestamps
+from squashfs import Compression, mksquashfs_command
+from targets import NODEJS_TARGET, PYTHON_TARGET, parse_target
+from unixfs import file_cid
+from utils import CID, make_dependencies_hash, read_file, run_subprocess, write_file
+from workspace import Workspace, build_pool, build_workspace
 
-# /opt/packages is by default imported into Python Aleph VMs
-PACKAGES_PATH = Path("/opt/packages")
+# Python volumes are mounted on /opt/packages and Node.js volumes on /opt/node_modules in Aleph VMs.
+PYTHON_MOUNT_PATH = Path("/opt/packages")
 
-# /opt/node_modules is by default imported into Node.js Aleph VMs
-MODULES_PATH = Path("/opt/node_modules")
+logger = logging.getLogger(__name__)
 
 
-async def prepare_paths(dependencies_path: Path, dependencies_hash: str):
-    """Prepares the paths for the dependencies and returns the path to the squashfs file."""
-    # check if directory exists, clean if necessary
-    if not dependencies_path.exists():
-        dependencies_path.mkdir(parents=True, exist_ok=True)
-    else:
-        shutil.rmtree(dependencies_path)
-        dependencies_path.mkdir(parents=True, exist_ok=True)
-    mksquashfs_dir = Path("/opt/sqashfs/")
-    mksquashfs_dir.mkdir(parents=True, exist_ok=True)
-    squashfs_path = mksquashfs_dir / Path(f"{dependencies_hash}.squashfs")
-    return squashfs_path
+@dataclass(frozen=True)
+class BuildOptions:
+    """How a volume is built, on top of its dependencies."""
 
+    compression: Compression = Compression(settings.COMPRESSION_PROFILE)
+    reproducible: bool = settings.REPRODUCIBLE_BUILDS
+    # Only applies to Python volumes
+    precompile: bool = settings.PRECOMPILE_BYTECODE
+    pruning: Pruning = Pruning(settings.PRUNING)
 
-async def build_and_upload_python_requirements(
-    requirements: List[str],
+    def key(self) -> List[str]:
+        """Identifies the options in the build cache key."""
+        return [
+            f"{name}={value.value if isinstance(value, Enum) else value}"
+            for name, value in sorted(asdict(self).items())
+        ]
+
+
+async def upload_volume(
+    squashfs_path: Path, target: str, build_hash: str, reproducible: bool = False
 ) -> CID:
-    dependencies_hash = make_dependencies_hash(requirements)
-    squashfs_path = await prepare_paths(PACKAGES_PATH, dependencies_hash)
-    try:
+    """Uploads a squashfs volume and records its CID in the build cache.
+
+    The CID of reproducible volumes is computed first, and they are not uploaded again
+    when it is already pinned. It cannot be computed with custom IPFS chunking.
+    """
+    size = squashfs_path.stat().st_size
+    predicted_cid = None
+    if reproducible and ipfs_pool.default_chunking:
+        predicted_cid = await asyncio.get_running_loop().run_in_executor(
+            None, file_cid, squashfs_path
+        )
+        if await ipfs_pool.is_pinned(predicted_cid):
+            logger.info(f"{predicted_cid} is already pinned, skipping its upload")
+            SKIPPED_UPLOADS.labels(target=target).inc()
+            build_cache.put(target, build_hash, predicted_cid, size)
+            return predicted_cid
+    with measure_phase(target, "upload"):
+        cid = await upload_sources(squashfs_path)
+    if predicted_cid and cid != predicted_cid:
+        logger.warning(
+            f"Predicted CID {predicted_cid} of {squashfs_path} but got {cid}, "
+            "the IPFS nodes may not use the default settings of `ipfs add`"
+        )
+    UPLOADED_BYTES.labels(target=target).inc(size)
+    build_cache.put(target, build_hash, cid, size)
+    return cid
+
+
+async def prune_volume(workspace: Workspace, target: str, pruning: Pruning) -> None:
+    """Removes the files of the volume directory that are not used at runtime."""
+    ecosystem = parse_target(target).ecosystem
+    with measure_phase(target, "prune"):
+        report = await asyncio.get_running_loop().run_in_executor(
+            None,
+            prune,
+            workspace.volume_path,
+            ecosystem,
+            pruning,
+            settings.PRUNING_EXTRA_PATTERNS.get(ecosystem, []),
+        )
+    PRUNED_BYTES.labels(target=target).inc(report.bytes)
+    logger.info(
+        f"Pruned {report.files} files ({report.bytes} bytes) from the {target} volume"
+    )
+
+
+async def compile_bytecode(
+    workspace: Workspace, target: str, optimization_levels: List[int]
+) -> None:
+    """Replaces the bytecode compiled by pip with bytecode for the mounted volume.
+
+    Skipped when the interpreter of the target is not installed on the builder.
+    """
+    interpreter = parse_target(target).interpreter
+    if shutil.which(interpreter) is None:
+        logger.warning(f"{interpreter} is not installed, not compiling the bytecode")
+        return
+    with measure_phase(target, "compile"):
+        await asyncio.get_running_loop().run_in_executor(
+            None, remove_bytecode, workspace.volume_path
+        )
         await run_subprocess(
-            f"pip install -t {str(PACKAGES_PATH)} {' '.join(requirements)}"
+            compile_bytecode_command(
+                workspace.volume_path,
+                PYTHON_MOUNT_PATH,
+                interpreter,
+                optimization_levels,
+            ),
+            **settings.phase_limits("compile"),
         )
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=422,
-            detail=f"Unprocessable requirements: {e.stderr}",
+
+
+async def make_reproducible(workspace: Workspace, target: str) -> None:
+    """Normalizes the volume directory so that it always gives the same image."""
+    with measure_phase(target, "normalize"):
+        await asyncio.get_running_loop().run_in_executor(
+            None, normalize_timestamps, workspace.volume_path
+        )
+
+
+async def squash_and_upload(
+    workspace: Workspace, target: str, build_hash: str, options: BuildOptions
+) -> CID:
+    """Squashes the volume directory of a workspace and uploads it.
+
+    Reproducible volumes are never streamed, their CID is computed from the whole image.
+    """
+    if options.pruning != Pruning.none:
+        await prune_volume(workspace, target, options.pruning)
+    python = parse_target(target).ecosystem == "python"
+    if python and options.precompile:
+        await compile_bytecode(workspace, target, settings.BYTECODE_OPTIMIZATION_LEVELS)
+    elif python and options.reproducible:
+        # The bytecode compiled by pip embeds the install time
+        await compile_bytecode(workspace, target, [0])
+    if options.reproducible:
+        await make_reproducible(workspace, target)
+    elif settings.STREAM_UPLOADS:
+        return await squash_and_stream(workspace, target, build_hash, options)
+    with measure_phase(target, "squash"):
+        await run_subprocess(
+            mksquashfs_command(
+                workspace.volume_path,
+                workspace.squashfs_path,
+                options.compression,
+                reproducible=options.reproducible,
+                fragments=not layered(target),
+            ),
+            **settings.phase_limits("squash"),
         )
-    await run_subprocess(f"mksquashfs {str(PACKAGES_PATH)} {squashfs_path}")
+    VOLUME_SIZE.labels(target=target).observe(workspace.squashfs_path.stat().st_size)
     (_, cid) = await asyncio.gather(
-        run_subprocess(f"rm -rf {str(PACKAGES_PATH)}"),
-        upload_sources(Path(squashfs_path)),
+        run_subprocess(f"rm -rf {str(workspace.volume_path)}"),
+        upload_volume(
+            workspace.squashfs_path, target, build_hash, options.reproducible
+        ),
     )
-    await run_subprocess(f"rm -rf {squashfs_path}")
     return cid
 
 
-async def build_and_upload_python_pipfile(
-    pipfile_path: Path,
+async def squash_and_stream(
+    workspace: Workspace, target: str, build_hash: str, options: BuildOptions
 ) -> CID:
-    with open(pipfile_path, "r") as fd:
-        pipfile = fd.read()
-    dependencies_hash = make_dependencies_hash(pipfile.split("\n"))
-    squashfs_path = await prepare_paths(PACKAGES_PATH, dependencies_hash)
+    """Squashes the volume directory of a workspace while uploading the image.
+
+    Duplicate detection is disabled, as it makes mksquashfs rewrite parts of the
+    image that may already have been uploaded.
+    """
+
+    async def squash():
+        with measure_phase(target, "squash"):
+            await run_subprocess(
+                mksquashfs_command(
+                    workspace.volume_path,
+                    workspace.squashfs_path,
+                    options.compression,
+                    duplicates=False,
+                    fragments=not layered(target),
+                ),
+                **settings.phase_limits("squash"),
+            )
+
+    squashing = asyncio.ensure_future(squash())
     try:
+        with measure_phase(target, "upload"):
+            cid = await stream_sources(workspace.squashfs_path, squashing)
+    finally:
+        squashing.cancel()
+    size = workspace.squashfs_path.stat().st_size
+    VOLUME_SIZE.labels(target=target).observe(size)
+    UPLOADED_BYTES.labels(target=target).inc(size)
+    build_cache.put(target, build_hash, cid, size)
+    return cid
+
+
+async def build_volume(
+    target: str,
+    dependencies_hash: str,
+    install: Callable[[Workspace], Awaitable[None]],
+    options: BuildOptions,
+    resolve: Optional[Callable[[Workspace], Awaitable[List[str]]]] = None,
+) -> CID:
+    """Returns the CID of the volume for the given dependencies, building it if needed.
+
+    `resolve`, if given, resolves the dependencies in the workspace and returns the
+    resolved set, then `install` fills the volume directory of the workspace.
+    With `HASH_RESOLVED_DEPENDENCIES`, volumes are also cached by resolved set, so that
+    different manifests resolving to the same packages share one build.
+    Identical builds running at the same time are only done once.
+    """
+    build_hash = make_dependencies_hash([dependencies_hash, *options.key()])
+    cid = await build_cache.get(target, build_hash)
+    if cid:
+        return cid
+
+    async def build() -> CID:
+        async with build_pool.slot(), build_workspace() as workspace:
+            start = time.monotonic()
+            try:
+                resolved_hash = None
+                if resolve:
+                    resolved = await resolve(workspace)
+                    if settings.HASH_RESOLVED_DEPENDENCIES:
+                        resolved_hash = make_dependencies_hash(
+                            ["resolved", *resolved, *options.key()]
+                        )
+                        cid = await build_cache.get(target, resolved_hash)
+                        if cid:
+                            build_cache.alias(target, build_hash, resolved_hash)
+                            return cid
+                await install(workspace)
+                artifact_cache.schedule_prune()
+                cid = await squash_and_upload(workspace, target, build_hash, options)
+            except subprocess.TimeoutExpired as e:
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"Build timed out after {e.timeout}s: {e.cmd}",
+                )
+            if resolved_hash:
+                build_cache.alias(target, resolved_hash, build_hash)
+            BUILD_DURATION.labels(target=target).observe(time.monotonic() - start)
+            return cid
+
+    return await in_flight_builds.run((target, build_hash), build)
+
+
+async def install_python_requirements(
+    workspace: Workspace,
+    requirements: List[str],
+    no_deps: bool = False,
+    target: str = PYTHON_TARGET,
+) -> None:
+    """Installs requirements, or a requirements.txt file, into the volume directory."""
+    installer = python_installer(settings.PYTHON_INSTALLER, parse_target(target))
+    with measure_installer(target, "install", installer.name):
         await run_subprocess(
-            f"cd {pipfile_path.parent} && pipenv lock && pipenv requirements > requirements.txt"
-        )
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=422,
-            detail=f"Unprocessable pipfile: {e.stderr}",
+            installer.install_command(
+                workspace.volume_path, requirement_arguments(requirements), no_deps
+            ),
+            **settings.phase_limits("install"),
         )
-    await run_subprocess(
-        f"pip install -t {str(PACKAGES_PATH)} -r {str(pipfile_path.parent / Path('requirements.txt'))}"
+
+
+def layered(target: str) -> bool:
+    """Whether volumes of a target are assembled from the layers of the package store."""
+    return settings.LAYERED_BUILDS and parse_target(target).ecosystem == "python"
+
+
+async def install_python_layers(
+    workspace: Workspace,
+    requirements: List[str],
+    link: bool = True,
+    target: str = PYTHON_TARGET,
+) -> None:
+    """Assembles the volume directory from the layers of pinned requirements.
+
+    Only the layers missing from the package store are installed, each on its own.
+    Options lines of the requirements (`--index-url`...) apply to all of them. With
+    `link`, the files of the volume are hard links to the files of the store.
+    """
+    options = requirement_arguments(
+        [line for line in requirements if line.startswith("-")]
     )
-    await run_subprocess(f"mksquashfs {str(PACKAGES_PATH)} {squashfs_path}")
-    (_, _, cid) = await asyncio.gather(
-        run_subprocess(f"rm -rf {str(pipfile_path.parent)}"),
-        run_subprocess(f"rm -rf {str(PACKAGES_PATH)}"),
-        upload_sources(Path(squashfs_path)),
+    pinned = [line for line in requirements if not line.startswith("-")]
+    installer = python_installer(settings.PYTHON_INSTALLER, parse_target(target))
+
+    async def layer(requirement: str) -> Path:
+        async def install(path: Path) -> None:
+            await run_subprocess(
+                installer.install_command(
+                    path, [*options, shlex.quote(requirement)], no_deps=True
+                ),
+                **settings.phase_limits("install"),
+            )
+
+        # Installers do not lay out the same files, e.g. in the .dist-info directories
+        key = package_store.layer_key(target, requirement, [installer.name, *options])
+        return await package_store.layer(key, install)
+
+    with measure_installer(target, "install", installer.name):
+        layers = await asyncio.gather(*(layer(requirement) for requirement in pinned))
+        await package_store.assemble(layers, workspace.volume_path, link)
+    package_store.schedule_prune()
+
+
+async def read_requirements_file(path: Path) -> List[str]:
+    """Canonical requirements of a requirements.txt written by a resolver."""
+    return normalize_requirements((await read_file(path)).split("\n"))
+
+
+async def build_and_upload_python_requirements(
+    requirements: List[str],
+    options: BuildOptions = BuildOptions(),
+    target: str = PYTHON_TARGET,
+) -> CID:
+    # Installed as given, their canonical form only keys the build
+    requirements = requirement_lines(requirements)
+    dependencies_hash = make_dependencies_hash(normalize_requirements(requirements))
+
+    async def resolve(workspace: Workspace) -> List[str]:
+        installer = python_installer(settings.PYTHON_INSTALLER, parse_target(target))
+        requirements_path = workspace.path / "requirements.in"
+        output_path = workspace.path / "resolved"
+        await write_file(requirements_path, "\n".join(requirements))
+        try:
+            with measure_installer(target, "resolve", installer.name):
+                await run_subprocess(
+                    installer.resolve_command(requirements_path, output_path),
+                    **settings.phase_limits("resolve"),
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Unprocessable requirements: {e.stderr}",
+            )
+        resolved = installer.resolved_requirements(await read_file(output_path))
+        await write_file(workspace.path / "requirements.txt", "\n".join(resolved))
+        return resolved
+
+    async def install(workspace: Workspace):
+        try:
+            if settings.LAYERED_BUILDS:
+                await install_python_layers(
+                    workspace,
+                    await read_requirements_file(workspace.path / "requirements.txt"),
+                    link=not options.reproducible,
+                    target=target,
+                )
+            elif settings.HASH_RESOLVED_DEPENDENCIES:
+                # Exactly the resolved set, that the volume is cached by
+                await install_python_requirements(
+                    workspace,
+                    ["-r", str(workspace.path / "requirements.txt")],
+                    True,
+                    target,
+                )
+            else:
+                await install_python_requirements(
+                    workspace, requirements, target=target
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Unprocessable requirements: {e.stderr}",
+            )
+
+    return await build_volume(
+        target,
+        dependencies_hash,
+        install,
+        options,
+        (
+            resolve
+            if settings.HASH_RESOLVED_DEPENDENCIES or settings.LAYERED_BUILDS
+            else None
+        ),
+    )
+
+
+async def build_and_upload_python_pipfile(
+    pipfile: str,
+    options: BuildOptions = BuildOptions(),
+) -> CID:
+    dependencies_hash = make_dependencies_hash(normalize_pipfile(pipfile))
+
+    async def resolve(workspace: Workspace) -> List[str]:
+        await write_file(workspace.path / "Pipfile", pipfile)
+        try:
+            with measure_phase(PYTHON_TARGET, "resolve"):
+                await run_subprocess(
+                    f"cd {str(workspace.path)} && pipenv lock && pipenv requirements > requirements.txt",
+                    **settings.phase_limits("resolve"),
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Unprocessable pipfile: {e.stderr}",
+            )
+        return await read_requirements_file(workspace.path / "requirements.txt")
+
+    async def install(workspace: Workspace):
+        if settings.LAYERED_BUILDS:
+            await install_python_layers(
+                workspace,
+                await read_requirements_file(workspace.path / "requirements.txt"),
+                link=not options.reproducible,
+            )
+        else:
+            await install_python_requirements(
+                workspace, ["-r", str(workspace.path / "requirements.txt")]
+            )
+
+    return await build_volume(
+        PYTHON_TARGET, dependencies_hash, install, options, resolve
     )
-    await run_subprocess(f"rm -rf {squashfs_path}")
-    return cid
 
 
 async def build_and_upload_python_pyproject(
-    pyproject_path: Path,
+    pyproject: str,
+    options: BuildOptions = BuildOptions(),
 ) -> CID:
-    with open(pyproject_path, "r") as fd:
-        pyproject = fd.read()
-    dependencies_hash = make_dependencies_hash(pyproject.split("\n"))
-    squashfs_path = await prepare_paths(PACKAGES_PATH, dependencies_hash)
-    try:
-        await run_subprocess(
-            f"cd {pyproject_path.parent} && poetry export -f requirements.txt -o requirements.txt --without-hashes"
-        )
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=422,
-            detail=f"Unprocessable pyproject.toml: {e.output}",
-        )
-    await run_subprocess(
-        f"pip install -t {str(PACKAGES_PATH)} -r {str(pyproject_path.parent / Path('requirements.txt'))}"
+    dependencies_hash = make_dependencies_hash(normalize_pyproject(pyproject))
+
+    async def resolve(workspace: Workspace) -> List[str]:
+        await write_file(workspace.path / "pyproject.toml", pyproject)
+        try:
+            with measure_phase(PYTHON_TARGET, "resolve"):
+                await run_subprocess(
+                    f"cd {str(workspace.path)} && poetry export -f requirements.txt -o requirements.txt --without-hashes",
+                    **settings.phase_limits("resolve"),
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Unprocessable pyproject.toml: {e.output}",
+            )
+        return await read_requirements_file(workspace.path / "requirements.txt")
+
+    async def install(workspace: Workspace):
+        if settings.LAYERED_BUILDS:
+            await install_python_layers(
+                workspace,
+                await read_requirements_file(workspace.path / "requirements.txt"),
+                link=not options.reproducible,
+            )
+        else:
+            await install_python_requirements(
+                workspace, ["-r", str(workspace.path / "requirements.txt")]
+            )
+
+    return await build_volume(
+        PYTHON_TARGET, dependencies_hash, install, options, resolve
     )
-    await run_subprocess(f"mksquashfs {str(PACKAGES_PATH)} {squashfs_path}")
-    (_, _, cid) = await asyncio.gather(
-        run_subprocess(f"rm -rf {str(pyproject_path.parent)}"),
-        run_subprocess(f"rm -rf {str(PACKAGES_PATH)}"),
-        upload_sources(Path(squashfs_path)),
+
+
+async def locked_requirements(
+    lock_hash: str, convert: Callable[[], Awaitable[List[str]]]
+) -> List[str]:
+    """Requirements converted from a lockfile, only converted once per lockfile."""
+    requirements = lockfile_cache.get(lock_hash)
+    if requirements is None:
+        requirements = await in_flight_builds.run(("lockfile", lock_hash), convert)
+        lockfile_cache.put(lock_hash, requirements)
+    return requirements
+
+
+async def build_and_upload_locked_python_requirements(
+    requirements: List[str],
+    options: BuildOptions = BuildOptions(),
+    target: str = PYTHON_TARGET,
+) -> CID:
+    """Installs exactly the requirements of a lockfile, without resolving them."""
+    dependencies_hash = make_dependencies_hash(["locked", *requirements])
+
+    async def install(workspace: Workspace):
+        requirements_path = workspace.path / "requirements.txt"
+        await write_file(requirements_path, "\n".join(requirements))
+        try:
+            if settings.LAYERED_BUILDS:
+                await install_python_layers(
+                    workspace, requirements, not options.reproducible, target
+                )
+            else:
+                await install_python_requirements(
+                    workspace, ["-r", str(requirements_path)], True, target
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Unprocessable lockfile: {e.stderr}",
+            )
+
+    return await build_volume(target, dependencies_hash, install, options)
+
+
+async def build_and_upload_python_pipfile_lock(
+    pipfile: str,
+    pipfile_lock: str,
+    options: BuildOptions = BuildOptions(),
+) -> CID:
+    async def convert() -> List[str]:
+        return pipfile_lock_requirements(pipfile, pipfile_lock)
+
+    requirements = await locked_requirements(
+        make_dependencies_hash(["Pipfile.lock", pipfile, pipfile_lock]), convert
     )
+    return await build_and_upload_locked_python_requirements(requirements, options)
 
-    await run_subprocess(f"rm -rf {squashfs_path}")
-    return cid
+
+async def build_and_upload_python_poetry_lock(
+    pyproject: str,
+    poetry_lock: str,
+    options: BuildOptions = BuildOptions(),
+) -> CID:
+    async def convert() -> List[str]:
+        # Exports the locked packages, poetry fails if the lockfile is out of date
+        async with build_pool.slot(), build_workspace() as workspace:
+            await write_file(workspace.path / "pyproject.toml", pyproject)
+            await write_file(workspace.path / "poetry.lock", poetry_lock)
+            try:
+                with measure_phase(PYTHON_TARGET, "export"):
+                    await run_subprocess(
+                        f"cd {str(workspace.path)} && poetry export -f requirements.txt -o requirements.txt --without-hashes",
+                        **settings.phase_limits("export"),
+                    )
+            except subprocess.CalledProcessError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Unprocessable poetry.lock: {e.output}",
+                )
+            except subprocess.TimeoutExpired as e:
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"Export timed out after {e.timeout}s: {e.cmd}",
+                )
+            return await read_requirements_file(workspace.path / "requirements.txt")
+
+    requirements = await locked_requirements(
+        make_dependencies_hash(
+            ["poetry.lock", *normalize_pyproject(pyproject), poetry_lock]
+        ),
+        convert,
+    )
+    return await build_and_upload_locked_python_requirements(requirements, options)
 
 
 async def build_and_upload_node_modules(
     modules: List[str],
+    options: BuildOptions = BuildOptions(),
 ) -> CID:
+    modules = normalize_modules(modules)
     dependencies_hash = make_dependencies_hash(modules)
-    squashfs_path = await prepare_paths(MODULES_PATH, dependencies_hash)
+
+    async def install(workspace: Workspace):
+        installer = node_installer(settings.NODEJS_INSTALLER)
+        prefix = workspace.path / "npm"
+        try:
+            with measure_installer(NODEJS_TARGET, "install", installer.name):
+                await run_subprocess(
+                    installer.install_modules_command(
+                        prefix, list(map(shlex.quote, modules))
+                    ),
+                    **settings.phase_limits("install"),
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid packages: {e.output}",
+            )
+        # Under node_modules/ in the volume, as the modules of package.json builds
+        await run_subprocess(
+            f"mv {str(installer.modules_path(prefix))} {str(workspace.volume_path / 'node_modules')}"
+        )
+
+    # Global installs have no lockfile to resolve the modules with
+    return await build_volume(NODEJS_TARGET, dependencies_hash, install, options)
+
+
+async def resolve_package_lock(directory: Path, package_json: str) -> str:
+    """Writes a package.json in a directory and returns its resolved package-lock.json."""
+    await write_file(directory / "package.json", package_json)
     try:
-        await run_subprocess(f"npm install -g {' '.join(modules)}")
+        with measure_phase(NODEJS_TARGET, "resolve"):
+            await run_subprocess(
+                f"cd {str(directory)} && npm install {artifact_cache.npm_options()} --package-lock-only --ignore-scripts",
+                **settings.phase_limits("resolve"),
+            )
     except subprocess.CalledProcessError as e:
         raise HTTPException(
             status_code=422,
-            detail=f"Invalid packages: {e.output}",
+            detail=f"Invalid package.json: {e.output}",
         )
-    await run_subprocess(f"mv /usr/local/lib/node_modules {str(MODULES_PATH)}")
-    await run_subprocess(f"mksquashfs {str(MODULES_PATH)} {squashfs_path}")
-    (_, _, cid) = await asyncio.gather(
-        run_subprocess("rm -rf /usr/local/lib/node_modules"),
-        run_subprocess(f"rm -rf {str(MODULES_PATH)}"),
-        upload_sources(Path(squashfs_path)),
-    )
-    await run_subprocess(f"rm -rf {squashfs_path}")
-    return cid
+    return await read_file(directory / "package-lock.json")
 
 
 async def build_and_upload_node_package(
-    packages_path: Path,
+    packages: str,
+    options: BuildOptions = BuildOptions(),
 ) -> CID:
-    with open(packages_path, "r") as fd:
-        packages = fd.read()
-    dependencies_hash = make_dependencies_hash(packages.split("\n"))
-    squashfs_path = await prepare_paths(MODULES_PATH, dependencies_hash)
-    await run_subprocess(f"mv {str(packages_path)} {str(MODULES_PATH)}")
-    try:
-        await run_subprocess(f"cd {str(MODULES_PATH)} && npm install")
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=422,
-            detail=f"Invalid package.json: {e.output}",
+    dependencies_hash = make_dependencies_hash(normalize_package_json(packages))
+    # Only the fields that matter, so that the volume matches its dependencies hash
+    package_json = json.dumps(reduce_package_json(packages), indent=2)
+
+    async def resolve(workspace: Workspace) -> List[str]:
+        package_lock = await resolve_package_lock(workspace.volume_path, package_json)
+        return resolved_node_modules(json.loads(package_lock))
+
+    async def install(workspace: Workspace):
+        if settings.HASH_RESOLVED_DEPENDENCIES:
+            # Only npm installs exactly the package-lock.json of the resolution
+            installer = NodeInstaller()
+        else:
+            installer = node_installer(settings.NODEJS_INSTALLER)
+            await write_file(workspace.volume_path / "package.json", package_json)
+        try:
+            with measure_installer(NODEJS_TARGET, "install", installer.name):
+                await run_subprocess(
+                    installer.install_package_command(workspace.volume_path),
+                    **settings.phase_limits("install"),
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid package.json: {e.output}",
+            )
+
+    return await build_volume(
+        NODEJS_TARGET,
+        dependencies_hash,
+        install,
+        options,
+        resolve if settings.HASH_RESOLVED_DEPENDENCIES else None,
+    )
+
+
+async def build_and_upload_node_package_lock(
+    packages: str,
+    package_lock: str,
+    options: BuildOptions = BuildOptions(),
+    target: str = NODEJS_TARGET,
+) -> CID:
+    """Installs the modules of a package-lock.json with `npm ci`, without resolving them."""
+    dependencies_hash = make_dependencies_hash(
+        [
+            "locked",
+            *normalize_package_json(packages),
+            *resolved_node_modules(parse_json(package_lock, "package-lock.json")),
+        ]
+    )
+    package_json = json.dumps(reduce_package_json(packages), indent=2)
+
+    async def install(workspace: Workspace):
+        await write_file(workspace.volume_path / "package.json", package_json)
+        await write_file(workspace.volume_path / "package-lock.json", package_lock)
+        try:
+            with measure_phase(target, "install"):
+                await run_subprocess(
+                    f"cd {str(workspace.volume_path)} && {parse_target(target).npm_environment()}npm ci {artifact_cache.npm_options()}",
+                    **settings.phase_limits("install"),
+                )
+        except subprocess.CalledProcessError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid package-lock.json: {e.output}",
+            )
+
+    return await build_volume(target, dependencies_hash, install, options)
+
+
+async def build_matrix(
+    targets: List[str], build: Callable[[str], Awaitable[CID]]
+) -> Dict[str, CID]:
+    """Builds the volume of every target in parallel, on the build pool.
+
+    All the builds run to completion, so that the volumes of the targets that succeeded
+    are cached when another one fails, then the error of the first failed one is raised.
+    """
+    results = await asyncio.gather(
+        *(build(target) for target in targets), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return dict(zip(targets, results))
+
+
+async def build_and_upload_python_matrix(
+    requirements: List[str],
+    targets: List[str],
+    options: BuildOptions = BuildOptions(),
+) -> Dict[str, CID]:
+    """Builds the volumes of requirements for several Python versions and platforms.
+
+    With uv, the requirements are resolved once for all the targets with environment
+    markers, and each target installs the packages its markers select. Otherwise every
+    target resolves them, and the downloads are shared through the caches.
+    """
+    requirements = requirement_lines(requirements)
+    installer = python_installer(settings.PYTHON_INSTALLER, parse_target(PYTHON_TARGET))
+    if not isinstance(installer, UvPythonInstaller):
+        return await build_matrix(
+            targets,
+            lambda target: build_and_upload_python_requirements(
+                requirements, options, target
+            ),
         )
-    await run_subprocess(f"mksquashfs {str(MODULES_PATH)} {squashfs_path}")
-    (_, _, cid) = await asyncio.gather(
-        run_subprocess(f"rm -rf {str(MODULES_PATH)}"),
-        run_subprocess(f"rm -rf {str(packages_path.parent)}"),
-        upload_sources(Path(squashfs_path)),
+
+    python_version = min(
+        (parse_target(target).version for target in targets),
+        key=lambda version: tuple(map(int, version.split("."))),
+    )
+
+    async def resolve() -> List[str]:
+        async with build_pool.slot(), build_workspace() as workspace:
+            requirements_path = workspace.path / "requirements.in"
+            output_path = workspace.path / "resolved"
+            await write_file(requirements_path, "\n".join(requirements))
+            try:
+                with measure_installer(PYTHON_TARGET, "resolve", installer.name):
+                    await run_subprocess(
+                        installer.universal_resolve_command(
+                            requirements_path, output_path, python_version
+                        ),
+                        **settings.phase_limits("resolve"),
+                    )
+            except subprocess.CalledProcessError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Unprocessable requirements: {e.stderr}",
+                )
+            except subprocess.TimeoutExpired as e:
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"Resolution timed out after {e.timeout}s: {e.cmd}",
+                )
+            return installer.resolved_requirements(await read_file(output_path))
+
+    # Identical matrix requests running at the same time share the resolution
+    resolve_hash = make_dependencies_hash(
+        [python_version, *normalize_requirements(requirements)]
+    )
+    resolved = await in_flight_builds.run(("universal", resolve_hash), resolve)
+    return await build_matrix(
+        targets,
+        lambda target: build_and_upload_locked_python_requirements(
+            resolved, options, target
+        ),
+    )
+
+
+async def build_and_upload_node_matrix(
+    packages: str,
+    targets: List[str],
+    options: BuildOptions = BuildOptions(),
+) -> Dict[str, CID]:
+    """Builds the volumes of a package.json for several Node.js versions.
+
+    The modules are resolved once, then every target installs the same package-lock.json.
+    """
+    package_json = json.dumps(reduce_package_json(packages), indent=2)
+
+    async def resolve() -> str:
+        async with build_pool.slot(), build_workspace() as workspace:
+            try:
+                return await resolve_package_lock(workspace.path, package_json)
+            except subprocess.TimeoutExpired as e:
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"Resolution timed out after {e.timeout}s: {e.cmd}",
+                )
+
+    # Identical matrix requests running at the same time share the resolution
+    resolve_hash = make_dependencies_hash(normalize_package_json(packages))
+    package_lock = await in_flight_builds.run(("package-lock", resolve_hash), resolve)
+    return await build_matrix(
+        targets,
+        lambda target: build_and_upload_node_package_lock(
+            packages, package_lock, options, target
+        ),
     )
-    await run_subprocess(f"rm -rf {squashfs_path}")
-    return cid
@@ -0,0 +1,30 @@
+"""
+Compilation of the Python bytecode of the volumes. Volumes are mounted read-only in
+the VMs, where the interpreter cannot cache the bytecode it compiles on imports.
+"""
+import shutil
+from pathlib import Path
+from typing import List
+
+
+def remove_bytecode(path: Path) -> None:
+    """Removes the bytecode compiled by pip, which embeds the install time."""
+    for pycache in list(path.rglob("__pycache__")):
+        shutil.rmtree(pycache, ignore_errors=True)
+
+
+def compile_bytecode_command(
+    path: Path, mount_path: Path, python: str, optimization_levels: List[int]
+) -> str:
+    """Compiles bytecode that does not depend on the time nor on the build directory.
+
+    Hash-based .pyc files are not checked against the source mtime, the paths in the
+    code objects are the ones of the volume once mounted in the VMs, and a fixed hash
+    seed keeps the order of the sets and frozensets of constants. A .pyc file is
+    written for each optimization level (0 for `python`, 2 for `python -OO`...).
+    """
+    levels = " ".join(f"-o {level}" for level in optimization_levels)
+    return (
+        f"PYTHONHASHSEED=0 {python} -m compileall -q -j 0 {levels} "
+        f"--invalidation-mode unchecked-hash -s {str(path)} -p {str(mount_path)} {str(path)}"
+    )
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from conf import settings
+from ipfs import ipfs_pool
+from metrics import CACHE_LOOKUPS, COALESCED_BUILDS
+from utils import CID, LogSink, build_log
+
+logger = logging.getLogger(__name__)
+
+# Returns None when it cannot be known whether the CID is still pinned
+PinChecker = Callable[[CID], Awaitable[Optional[bool]]]
+T = TypeVar("T")
+
+
+class BuildCache:
+    """Persistent index of the volumes already built, keyed by target and dependencies hash.
+
+    Entries are evicted when they are older than `max_age` seconds, and the least
+    recently used ones are dropped when the index holds more than `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int,
+        max_age: float,
+        pin_checker: Optional[PinChecker] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.pin_checker = pin_checker
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS builds ("
+                " target TEXT NOT NULL,"
+                " dependencies_hash TEXT NOT NULL,"
+                " cid TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (target, dependencies_hash))"
+            )
+            self._db.commit()
+        return self._db
+
+    async def get(self, target: str, dependencies_hash: str) -> Optional[CID]:
+        """Returns the CID of a previous build, if it is still valid."""
+        now = time.time()
+        row = self.db.execute(
+            "SELECT cid, created FROM builds WHERE target = ? AND dependencies_hash = ?",
+            (target, dependencies_hash),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+
+        cid, created = row
+        # Entries are only dropped once their CID is known not to be pinned anymore,
+        # not when the IPFS nodes cannot be reached
+        if now - created > self.max_age or (
+            self.pin_checker and await self.pin_checker(CID(cid)) is False
+        ):
+            logger.debug(f"Discarding stale cache entry {target}/{dependencies_hash}")
+            self.discard(target, dependencies_hash)
+            self.misses += 1
+            CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+
+        self.db.execute(
+            "UPDATE builds SET last_used = ? WHERE target = ? AND dependencies_hash = ?",
+            (now, target, dependencies_hash),
+        )
+        self.db.commit()
+        self.hits += 1
+        CACHE_LOOKUPS.labels(result="hit").inc()
+        return CID(cid)
+
+    def put(self, target: str, dependencies_hash: str, cid: CID, size: int) -> None:
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?)",
+            (target, dependencies_hash, cid, size, now, now),
+        )
+        self.db.commit()
+        self.evict()
+
+    def alias(self, target: str, dependencies_hash: str, existing_hash: str) -> None:
+        """Makes a dependencies hash point to the build of another one."""
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO builds "
+            "SELECT target, ?, cid, size, ?, ? FROM builds "
+            "WHERE target = ? AND dependencies_hash = ?",
+            (dependencies_hash, now, now, target, existing_hash),
+        )
+        self.db.commit()
+
+    def discard(self, target: str, dependencies_hash: str) -> None:
+        self.db.execute(
+            "DELETE FROM builds WHERE target = ? AND dependencies_hash = ?",
+            (target, dependencies_hash),
+        )
+        self.db.commit()
+
+    def evict(self) -> int:
+        """Removes expired entries, then the least recently used ones above the limit."""
+        expired = self.db.execute(
+            "DELETE FROM builds WHERE created < ?", (time.time() - self.max_age,)
+        ).rowcount
+        overflow = self.db.execute(
+            "DELETE FROM builds WHERE rowid IN ("
+            " SELECT rowid FROM builds ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.db.commit()
+        self.evictions += expired + overflow
+        return expired + overflow
+
+    def stats(self) -> Dict[str, int]:
+        (entries, size) = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM builds"
+        ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size": size,
+        }
+
+
+build_cache = BuildCache(
+    path=settings.BUILD_CACHE_PATH,
+    max_entries=settings.BUILD_CACHE_MAX_ENTRIES,
+    max_age=settings.BUILD_CACHE_MAX_AGE,
+    pin_checker=ipfs_pool.is_pinned if settings.BUILD_CACHE_VERIFY_PINS else None,
+)
+
+
+class LockfileCache:
+    """Persistent index of the requirements converted from lockfiles, keyed by lockfile hash.
+
+    The least recently used entries are dropped when it holds more than `max_entries`.
+    """
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lockfiles ("
+                " lock_hash TEXT PRIMARY KEY,"
+                " requirements TEXT NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def get(self, lock_hash: str) -> Optional[List[str]]:
+        row = self.db.execute(
+            "SELECT requirements FROM lockfiles WHERE lock_hash = ?", (lock_hash,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.db.execute(
+            "UPDATE lockfiles SET last_used = ? WHERE lock_hash = ?",
+            (time.time(), lock_hash),
+        )
+        self.db.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, lock_hash: str, requirements: List[str]) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO lockfiles VALUES (?, ?, ?)",
+            (lock_hash, json.dumps(requirements), time.time()),
+        )
+        self.db.execute(
+            "DELETE FROM lockfiles WHERE rowid IN ("
+            " SELECT rowid FROM lockfiles ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        (entries,) = self.db.execute("SELECT COUNT(*) FROM lockfiles").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+# Shares the database of the build cache
+lockfile_cache = LockfileCache(
+    path=settings.BUILD_CACHE_PATH,
+    max_entries=settings.LOCKFILE_CACHE_MAX_ENTRIES,
+)
+
+
+class SingleFlight:
+    """De-duplicates identical builds running at the same time.
+
+    Callers asking for a key that is already being built wait for the result of
+    the running build instead of starting their own. A build is cancelled once all
+    the callers waiting for it are gone.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.waiters: Dict[Hashable, int] = {}
+        # Build logs of the callers waiting for each key, that all get its output
+        self.sinks: Dict[Hashable, List[LogSink]] = {}
+        self.coalesced = 0
+
+    def _done(self, key: Hashable) -> None:
+        self.in_flight.pop(key, None)
+        self.waiters.pop(key, None)
+        self.sinks.pop(key, None)
+
+    async def run(self, key: Hashable, build: Callable[[], Awaitable[T]]) -> T:
+        future = self.in_flight.get(key)
+        if future is None:
+            sinks: List[LogSink] = []
+
+            def log(line: str) -> None:
+                for sink in list(sinks):
+                    sink(line)
+
+            async def logged_build() -> T:
+                # Runs in a copy of the context of the first caller only
+                build_log.set(log)
+                return await build()
+
+            future = asyncio.ensure_future(logged_build())
+            self.in_flight[key] = future
+            self.waiters[key] = 0
+            self.sinks[key] = sinks
+            future.add_done_callback(lambda _: self._done(key))
+        else:
+            logger.debug(f"Waiting for the build of {key} already in progress")
+            self.coalesced += 1
+            COALESCED_BUILDS.inc()
+        self.waiters[key] += 1
+        sink = build_log.get()
+        if sink:
+            self.sinks[key].append(sink)
+        try:
+            # Shielded, so that a caller going away does not cancel the build for the others
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.done():
+                self.waiters[key] -= 1
+                if sink:
+                    self.sinks[key].remove(sink)
+                if self.waiters[key] == 0:
+                    logger.debug(f"Cancelling the build of {key}, nobody waits for it")
+                    future.cancel()
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self.in_flight), "coalesced": self.coalesced}
+
+
+in_flight_builds = SingleFlight()
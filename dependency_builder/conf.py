@@ -0,0 +1,137 @@
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    # IPFS nodes the volumes are uploaded to, tried in order unless uploads fan out to all of them
+    IPFS_MULTIADDRS: List[str] = ["/dns6/ipfs-2.aleph.im/tcp/443/https"]
+    IPFS_FAN_OUT: bool = False
+    IPFS_RETRIES: int = 3
+    IPFS_RETRY_BACKOFF: float = 1.0  # seconds, doubled after every retry
+    IPFS_UPLOAD_TIMEOUT: float = 30 * 60  # seconds
+    IPFS_MAX_CONNECTIONS: int = 16
+    # Chunker and leaves of the uploads (`ipfs add --chunker --raw-leaves`), the defaults
+    # of the nodes when not set. A content-defined chunker such as "buzhash" keeps the
+    # packages shared by several images shared in storage, but the CIDs of reproducible
+    # images can then not be predicted, and their uploads are never skipped.
+    IPFS_CHUNKER: Optional[str] = None
+    IPFS_RAW_LEAVES: bool = False
+
+    # Compression profile of the volumes when not given in the request, see squashfs.py
+    COMPRESSION_PROFILE: str = "default"
+    # Threads used by mksquashfs, all the CPUs by default
+    SQUASHFS_PROCESSORS: Optional[int] = None
+    # Build byte-for-byte reproducible images when not given in the request. Their CID
+    # is known before uploading them, and the upload is skipped if it is already pinned.
+    REPRODUCIBLE_BUILDS: bool = False
+    # Precompile the bytecode of Python volumes when not given in the request, for each
+    # optimization level (0 for `python`, 2 for `python -OO` as used by init1.py).
+    # VMs mount the volumes read-only and would otherwise compile it on every boot.
+    PRECOMPILE_BYTECODE: bool = False
+    BYTECODE_OPTIMIZATION_LEVELS: List[int] = [0, 2]
+    # Files removed from the installed trees before squashing them, when not given in the
+    # request: none, safe or aggressive, see pruning.py. The extra patterns of each
+    # ecosystem (python, nodejs) extend the rules of both levels, e.g. {"python": ["*.txt"]}.
+    PRUNING: str = "safe"
+    PRUNING_EXTRA_PATTERNS: Dict[str, List[str]] = {}
+
+    # Upload squashfs images to IPFS while they are being built.
+    # Streamed images are chunked by MFS, so their CIDs differ from the ones of `ipfs add`.
+    STREAM_UPLOADS: bool = False
+    STREAM_UPLOAD_CHUNK_SIZE: int = 4 * 1024**2  # bytes
+    # Start of the image rewritten by mksquashfs once done, uploaded last
+    STREAM_UPLOAD_HEADER_SIZE: int = 4096  # bytes
+
+    # Index of previous builds, mapping dependency hashes to volume CIDs
+    BUILD_CACHE_PATH: Path = Path("/opt/cache/builds.sqlite3")
+    BUILD_CACHE_MAX_ENTRIES: int = 10_000
+    BUILD_CACHE_MAX_AGE: float = 30 * 24 * 3600  # seconds
+    # Check that a cached CID is still pinned before returning it
+    BUILD_CACHE_VERIFY_PINS: bool = False
+    # Also cache volumes by their resolved dependencies, at the cost of a resolution
+    # step before every build. Manifests resolving to the same packages share a volume.
+    HASH_RESOLVED_DEPENDENCIES: bool = False
+    # Requirements converted from Pipfile.lock and poetry.lock files, by lockfile hash
+    LOCKFILE_CACHE_MAX_ENTRIES: int = 10_000
+
+    # Assemble Python volumes from the install trees of each of their pinned packages,
+    # kept in a store shared by the builds, and only install the packages missing from it.
+    # Layered builds resolve the dependencies first and are squashed without fragments,
+    # so that the packages shared by several images are stored contiguously in them.
+    LAYERED_BUILDS: bool = False
+    PACKAGE_STORE_PATH: Path = Path("/opt/cache/packages")
+    PACKAGE_STORE_MAX_SIZE: int = 20 * 1024**3  # bytes
+    PACKAGE_STORE_MAX_CONCURRENT_INSTALLS: int = 4
+
+    # Package manager caches shared by the builds
+    PIP_CACHE_PATH: Path = Path("/opt/cache/pip")
+    WHEELHOUSE_PATH: Path = Path("/opt/cache/wheelhouse")
+    NPM_CACHE_PATH: Path = Path("/opt/cache/npm")
+    UV_CACHE_PATH: Path = Path("/opt/cache/uv")
+    PNPM_STORE_PATH: Path = Path("/opt/cache/pnpm")
+    ARTIFACT_CACHE_MAX_SIZE: int = 20 * 1024**3  # bytes
+    # Local mirrors of the package indexes
+    PIP_INDEX_URL: Optional[str] = None
+    NPM_REGISTRY: Optional[str] = None
+    # Only install packages from the wheelhouse and the npm cache
+    OFFLINE_INSTALLS: bool = False
+    # Installer backend of each runtime, see installers.py: pip or uv for Python, npm or
+    # pnpm for Node.js. pip and npm are used when the backend is not installed.
+    PYTHON_INSTALLER: str = "pip"
+    NODEJS_INSTALLER: str = "npm"
+
+    # Targets of the matrix builds besides python3.9 and nodejs, see targets.py: Python
+    # versions and wheel platforms, and Node.js major versions with the full version
+    # that native addons are built for.
+    MATRIX_PYTHON_VERSIONS: List[str] = ["3.9", "3.10", "3.11", "3.12"]
+    MATRIX_PYTHON_PLATFORMS: List[str] = [
+        "manylinux2014_x86_64",
+        "manylinux2014_aarch64",
+    ]
+    MATRIX_NODEJS_VERSIONS: Dict[str, str] = {
+        "16": "16.20.2",
+        "18": "18.20.4",
+        "20": "20.17.0",
+    }
+    MATRIX_MAX_TARGETS: int = 8
+
+    # Largest request body accepted, uploaded manifests and lockfiles included
+    MAX_UPLOAD_SIZE: int = 8 * 1024**2  # bytes
+
+    # Every build gets its own scratch directory in there
+    WORKSPACES_PATH: Path = Path("/opt/builds")
+    MAX_CONCURRENT_BUILDS: int = os.cpu_count() or 1
+    MAX_QUEUED_BUILDS: int = 100
+    # Wall-clock and CPU time limits of the subprocesses run in each build phase (resolve,
+    # export, install, compile, squash), in seconds. Phases not listed are not limited.
+    PHASE_TIMEOUTS: Dict[str, float] = {
+        "resolve": 600,
+        "export": 300,
+        "install": 1800,
+        "compile": 600,
+        "squash": 1800,
+    }
+    PHASE_CPU_LIMITS: Dict[str, int] = {}
+
+    # Finished build jobs are kept this long for their status to be queried
+    JOBS_MAX_AGE: float = 3600  # seconds
+    # Output lines of the package managers kept for each job, the oldest are dropped
+    JOBS_MAX_LOG_LINES: int = 10_000
+
+    def phase_limits(self, phase: str) -> Dict[str, Optional[float]]:
+        """Limits of the subprocesses of a build phase, as `run_subprocess` arguments."""
+        return {
+            "timeout": self.PHASE_TIMEOUTS.get(phase),
+            "cpu_limit": self.PHASE_CPU_LIMITS.get(phase),
+        }
+
+    class Config:
+        env_prefix = "BUILDER_"
+        case_sensitive = False
+        env_file = ".env"
+
+
+settings = Settings()
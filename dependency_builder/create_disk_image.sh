@@ -48,7 +48,10 @@ pip3 install 'coincurve==15.0.0'
 which python3
 python3 -m compileall -f /usr/local/lib/python3.9
 
-pip3 install -t /opt/packages 'poetry~=1.5.1' 'pipenv~=2023.7.4' 'aleph-sdk-python==0.6.0' 'uvicorn[standard]~=0.22.0' 'aioipfs~=0.6.3'
+# pip >= 22.2 is needed for `pip install --report`
+pip3 install --upgrade 'pip>=22.2'
+
+pip3 install -t /opt/packages 'poetry~=1.5.1' 'pipenv~=2023.7.4' 'aleph-sdk-python==0.6.0' 'uvicorn[standard]~=0.22.0' 'aioipfs~=0.6.3' 'prometheus-client~=0.17.0' 'packaging>=21.0' 'tomli~=2.0'
 
 echo "PubkeyAuthentication yes" >> /etc/ssh/sshd_config
 echo "PasswordAuthentication no" >> /etc/ssh/sshd_config
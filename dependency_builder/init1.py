@@ -14,17 +14,33 @@ logger.debug("Imports starting")
 import asyncio
 import ctypes
 import os
+import re
 import socket
+import struct
 import subprocess
 import sys
+import time
 import traceback
-from contextlib import redirect_stdout
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from enum import Enum
+from functools import lru_cache
 from io import StringIO
 from os import system
 from shutil import make_archive
-from typing import Any, AsyncIterable, Dict, List, NewType, Optional, Tuple, Union
+from typing import (
+    Any,
+    AsyncIterable,
+    Dict,
+    Iterator,
+    List,
+    NewType,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 import aiohttp
 import msgpack
@@ -49,6 +65,10 @@ class ShutdownException(Exception):
     pass
 
 
+class InstructionTooLarge(ValueError):
+    pass
+
+
 @dataclass
 class Volume:
     mount: str
@@ -58,10 +78,11 @@ class Volume:
 
 @dataclass
 class ConfigurationPayload:
-    input_data: bytes
+    # Views of the buffer of the configuration once received
+    input_data: Union[bytes, memoryview]
     interface: Interface
     vm_hash: str
-    code: bytes = None
+    code: Union[bytes, memoryview] = None
     encoding: Encoding = None
     entrypoint: str = None
     ip: Optional[str] = None
@@ -76,15 +97,119 @@ class RunCodePayload:
     scope: Dict
 
 
-# Open a socket to receive instructions from the host
-s = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-s.bind((socket.VMADDR_CID_ANY, 52))
-s.listen()
+@dataclass
+class HTTPClientSettings:
+    """HTTP client of the executable programs, shared by all the requests.
+
+    Tuned with the variables of the VM: ALEPH_INIT_HTTP_MAX_CONNECTIONS,
+    ALEPH_INIT_HTTP_KEEPALIVE_TIMEOUT, ALEPH_INIT_HTTP_TIMEOUT (seconds) and
+    ALEPH_INIT_HTTP_UNIX_SOCKET, to reach the program on a unix socket instead of TCP.
+    The program is ready once it accepts connections, or once ALEPH_INIT_HTTP_HEALTH_PATH
+    answers without a server error. The boot waits ALEPH_INIT_HTTP_READY_TIMEOUT for it,
+    then requests wait ALEPH_INIT_HTTP_READY_WAIT before getting the loading page.
+    """
+
+    max_connections: int = 100
+    # Below the 5s of uvicorn and other servers, so that they never close the idle
+    # connections first, while a request is being sent on them
+    keepalive_timeout: float = 4
+    timeout: float = 5
+    unix_socket: Optional[str] = None
+    health_path: Optional[str] = None
+    ready_timeout: float = 10
+    ready_wait: float = 1
+
+    @classmethod
+    def from_variables(
+        cls, variables: Optional[Dict[str, str]]
+    ) -> "HTTPClientSettings":
+        variables = variables or {}
+        settings = cls()
+        for name, type_ in (
+            ("max_connections", int),
+            ("keepalive_timeout", float),
+            ("timeout", float),
+            ("unix_socket", str),
+            ("health_path", str),
+            ("ready_timeout", float),
+            ("ready_wait", float),
+        ):
+            value = variables.get(f"ALEPH_INIT_HTTP_{name.upper()}")
+            if value is None:
+                continue
+            try:
+                setattr(settings, name, type_(value))
+            except ValueError:
+                logger.warning(f"Invalid value {value!r} of {name}, ignored")
+        return settings
+
+    def session(self) -> aiohttp.ClientSession:
+        """A pooled session keeping the connections to the program alive."""
+        if self.unix_socket:
+            connector = aiohttp.UnixConnector(
+                path=self.unix_socket,
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+        else:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+
+# Length prefix of the configuration: at most 9 ASCII digits followed by a newline
+LENGTH_HEADER_SIZE = 10
+# Size of the first read, holding the length prefix and the start of the configuration
+FIRST_READ_SIZE = 64 * 1024
+# Sizes of the length of the msgpack bin 8, bin 16 and bin 32 types, by type byte
+BIN_LENGTH_SIZES = {0xC4: 1, 0xC5: 2, 0xC6: 4}
+# The other values of the configuration are decoded by slices of this size
+CONFIG_VALUE_READ_SIZE = 64 * 1024
+# Instructions of the supervisor are read by chunks of this size. Older supervisors do not
+# prefix them with their length, they are read in a single chunk.
+INSTRUCTION_READ_SIZE = 1000_1000  # Max 1 Mo
+# Length prefix of the instructions and responses, the digits are never the start of
+# an instruction without prefix: halt, a !command or a msgpack map.
+INSTRUCTION_LENGTH_PREFIX = re.compile(rb"(\d{1,19})\n")
+# Largest prefixed instruction accepted, tuned with the ALEPH_INIT_MAX_INSTRUCTION_SIZE
+# variable of the VM. Larger ones are rejected before allocating their buffer.
+MAX_INSTRUCTION_SIZE = 256 * 1024 * 1024
+# Large bytes of the responses are written by slices of this size
+RESPONSE_CHUNK_SIZE = 1024 * 1024
+
+# Executable programs serve HTTP on this address
+APP_HOST = "localhost"
+APP_PORT = 8080
+APP_URL = f"http://{APP_HOST}:{APP_PORT}"
+# Delays between the readiness probes of executable programs, doubled after each probe
+PROBE_INITIAL_DELAY = 0.01  # seconds
+PROBE_MAX_DELAY = 0.5  # seconds
+
+# Requests run at the same time by an ASGI program, tuned with the
+# ALEPH_INIT_MAX_CONCURRENT_REQUESTS variable of the VM
+MAX_CONCURRENT_REQUESTS = 64
+
+# Bytes-like objects written to the supervisor, forming one message
+Message = List[Union[bytes, bytearray, memoryview]]
+
+
+def open_host_socket() -> socket.socket:
+    """Open a socket to receive instructions from the host, and tell it we are ready."""
+    s = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    s.bind((socket.VMADDR_CID_ANY, 52))
+    s.listen()
+
+    # Send the host that we are ready
+    s0 = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    s0.connect((2, 52))
+    s0.close()
+    return s
 
-# Send the host that we are ready
-s0 = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-s0.connect((2, 52))
-s0.close()
 
 # Configure aleph-client to use the guest API
 os.environ["ALEPH_API_HOST"] = "http://localhost"
@@ -145,12 +270,17 @@ def setup_network(
             resolvconf_fd.write(f"nameserver {server}\n".encode())
 
 
-def setup_input_data(input_data: bytes):
+def write_file(path: str, data: Union[bytes, memoryview]):
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def setup_input_data(input_data: Union[bytes, memoryview]):
     logger.debug("Extracting data")
     if input_data:
         # Unzip in /data
         if not os.path.exists("/opt/input.zip"):
-            open("/opt/input.zip", "wb").write(input_data)
+            write_file("/opt/input.zip", input_data)
             os.makedirs("/data", exist_ok=True)
             os.system("unzip -q /opt/input.zip -d /data")
 
@@ -167,9 +297,63 @@ def setup_volumes(volumes: List[Volume]):
     system("mount")
 
 
+# Output of the request run by the current task, and by the tasks it starts
+request_output: ContextVar[Optional[StringIO]] = ContextVar(
+    "request_output", default=None
+)
+
+
+class RequestOutput:
+    """Replaces sys.stdout or sys.stderr, writing to the output of the current request.
+
+    Writes outside of any request go to the replaced stream, as the writes of the tasks
+    started by a request that go on after its response.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        output = request_output.get()
+        if output is None or output.closed:
+            return self.stream.write(text)
+        return output.write(text)
+
+    def flush(self) -> None:
+        output = request_output.get()
+        if output is None or output.closed:
+            self.stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        # encoding, fileno, isatty... of the replaced stream
+        return getattr(self.stream, name)
+
+
+def capture_request_output():
+    """Capture the output of the requests separately, even when they run concurrently."""
+    if not isinstance(sys.stdout, RequestOutput):
+        sys.stdout = RequestOutput(sys.stdout)
+    if not isinstance(sys.stderr, RequestOutput):
+        sys.stderr = RequestOutput(sys.stderr)
+
+
+@contextmanager
+def request_output_buffer() -> Iterator[StringIO]:
+    """Buffer of the output of the current request."""
+    with StringIO() as buffer:
+        token = request_output.set(buffer)
+        try:
+            yield buffer
+        finally:
+            request_output.reset(token)
+
+
 def setup_code_asgi(
     code: bytes, encoding: Encoding, entrypoint: str
 ) -> ASGIApplication:
+    # Before importing the program, that may keep a reference to the streams
+    capture_request_output()
+
     # Allow importing packages from /opt/packages
     sys.path.append("/opt/packages")
 
@@ -186,7 +370,7 @@ def setup_code_asgi(
     elif encoding == Encoding.zip:
         # Unzip in /opt and import the entrypoint from there
         if not os.path.exists("/opt/archive.zip"):
-            open("/opt/archive.zip", "wb").write(code)
+            write_file("/opt/archive.zip", code)
             logger.debug("Run unzip")
             os.system("unzip -q /opt/archive.zip -d /opt")
         sys.path.append("/opt")
@@ -217,7 +401,7 @@ def setup_code_executable(
             raise FileNotFoundError(f"No such file: {path}")
         os.system(f"chmod +x {path}")
     elif encoding == Encoding.zip:
-        open("/opt/archive.zip", "wb").write(code)
+        write_file("/opt/archive.zip", code)
         logger.debug("Run unzip")
         os.makedirs("/opt/code", exist_ok=True)
         os.system("unzip /opt/archive.zip -d /opt/code")
@@ -229,7 +413,7 @@ def setup_code_executable(
     elif encoding == Encoding.plain:
         os.makedirs("/opt/code", exist_ok=True)
         path = f"/opt/code/executable {entrypoint}"
-        open(path, "wb").write(code)
+        write_file(path, code)
         os.system(f"chmod +x {path}")
     else:
         raise ValueError(f"Unknown encoding '{encoding}'. This should never happen.")
@@ -258,7 +442,7 @@ async def run_python_code_http(
     application: ASGIApplication, scope: dict
 ) -> Tuple[Dict, Dict, str, Optional[bytes]]:
     logger.debug("Running code")
-    with StringIO() as buf, redirect_stdout(buf):
+    with request_output_buffer() as buf:
         # Execute in the same process, saves ~20ms than a subprocess
 
         # The body should not be part of the ASGI scope itself
@@ -314,7 +498,7 @@ async def run_python_code_http(
 async def make_request(session, scope):
     async with session.request(
         scope["method"],
-        url="http://localhost:8080{}".format(scope["path"]),
+        url="{}{}".format(APP_URL, scope["path"]),
         params=scope["query_string"],
         headers=[(a.decode("utf-8"), b.decode("utf-8")) for a, b in scope["headers"]],
         data=scope.get("body", None),
@@ -329,9 +513,14 @@ async def make_request(session, scope):
     return headers, body
 
 
+@lru_cache()
+def loading_page() -> str:
+    return Path("/root/loading.html").read_text()
+
+
 def show_loading():
     body = {
-        "body": Path("/root/loading.html").read_text()
+        "body": loading_page()
     }
     headers = {
         "headers": [
@@ -345,23 +534,86 @@ def show_loading():
     return headers, body
 
 
-async def run_executable_http(scope: dict) -> Tuple[Dict, Dict, str, Optional[bytes]]:
-    logger.debug("Calling localhost")
+class Readiness:
+    """Whether an executable program serves HTTP yet.
+
+    The program is probed from its start with an exponential backoff, and the requests
+    arriving before it is ready all wait for the same event.
+    """
+
+    def __init__(
+        self,
+        process: subprocess.Popen,
+        settings: HTTPClientSettings,
+        session: aiohttp.ClientSession,
+    ):
+        self.process = process
+        self.settings = settings
+        self.session = session
+        self.ready = asyncio.Event()
+        self.started = time.monotonic()
+        self.time_to_ready: Optional[float] = None
+        self.task = asyncio.ensure_future(self.probe_until_ready())
+
+    async def probe(self) -> bool:
+        try:
+            if self.settings.health_path:
+                url = f"{APP_URL}{self.settings.health_path}"
+                async with self.session.get(url) as response:
+                    return response.status < 500
+            if self.settings.unix_socket:
+                _, writer = await asyncio.open_unix_connection(
+                    self.settings.unix_socket
+                )
+            else:
+                _, writer = await asyncio.open_connection(APP_HOST, APP_PORT)
+            writer.close()
+            return True
+        except (OSError, aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def probe_until_ready(self) -> None:
+        delay = PROBE_INITIAL_DELAY
+        while not await self.probe():
+            if self.process.poll() is not None:
+                logger.error(
+                    f"Program exited with code {self.process.returncode} before being ready"
+                )
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, PROBE_MAX_DELAY)
+        self.time_to_ready = time.monotonic() - self.started
+        logger.info(f"Program ready in {self.time_to_ready:.3f}s")
+        self.ready.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for the program to be ready, at most `timeout` seconds.
+
+        Returns False early if the program exited before being ready.
+        """
+        try:
+            # The probes end once the program is ready, or once it exited
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.ready.is_set()
 
-    tries = 0
-    headers = None
-    body = None
 
-    timeout = aiohttp.ClientTimeout(total=5)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        while not body:
-            try:
-                tries += 1
-                headers, body = await make_request(session, scope)
-            except aiohttp.ClientConnectorError:
-                if tries > 20:
-                    headers, body = show_loading()
-                await asyncio.sleep(0.05)
+async def run_executable_http(
+    scope: dict,
+    session: aiohttp.ClientSession,
+    readiness: Optional[Readiness] = None,
+) -> Tuple[Dict, Dict, str, Optional[bytes]]:
+    logger.debug("Calling localhost")
+
+    if readiness and not await readiness.wait(readiness.settings.ready_wait):
+        headers, body = show_loading()
+    else:
+        try:
+            headers, body = await make_request(session, scope)
+        except aiohttp.ClientConnectorError:
+            # The program stopped listening after being ready
+            headers, body = show_loading()
 
     output = ""  # Process stdout is not captured per request
     output_data = None
@@ -369,11 +621,87 @@ async def run_executable_http(scope: dict) -> Tuple[Dict, Dict, str, Optional[by
     return headers, body, output, output_data
 
 
+def pack_value(packer: msgpack.Packer, value: Any) -> Iterator[bytes]:
+    if isinstance(value, (bytes, bytearray)) and len(value) > RESPONSE_CHUNK_SIZE:
+        # bin 32 header, the bytes follow as they are
+        yield struct.pack(">BI", 0xC6, len(value))
+        view = memoryview(value)
+        for start in range(0, len(value), RESPONSE_CHUNK_SIZE):
+            yield view[start : start + RESPONSE_CHUNK_SIZE]
+    elif isinstance(value, dict):
+        yield packer.pack_map_header(len(value))
+        for key, item in value.items():
+            yield packer.pack(key)
+            yield from pack_value(packer, item)
+    else:
+        yield packer.pack(value)
+
+
+def pack_response(result: Dict) -> Message:
+    """Pack a response as msgpack, by pieces. Large bytes such as the body or the output
+    data are sliced instead of copied into a single document."""
+    packer = msgpack.Packer(use_bin_type=True)
+    return list(pack_value(packer, result))
+
+
+async def read_instruction(
+    reader: asyncio.StreamReader, max_size: int = MAX_INSTRUCTION_SIZE
+) -> Tuple[Union[bytes, bytearray], bool]:
+    """Read an instruction of the supervisor, and whether it was prefixed with its length.
+
+    Prefixed instructions are read into a buffer allocated once for their length, and
+    rejected with InstructionTooLarge above `max_size` bytes. Instructions without prefix
+    are truncated to INSTRUCTION_READ_SIZE.
+    """
+    head = await reader.read(INSTRUCTION_READ_SIZE)
+    while head.isdigit() and len(head) < 20:
+        chunk = await reader.read(INSTRUCTION_READ_SIZE)
+        if not chunk:
+            break
+        head += chunk
+    match = INSTRUCTION_LENGTH_PREFIX.match(head)
+    if not match:
+        if len(head) >= INSTRUCTION_READ_SIZE:
+            logger.warning(
+                f"Instruction without length prefix truncated to {len(head)}"
+            )
+        return head, False
+
+    length = int(match[1])
+    if length > max_size:
+        raise InstructionTooLarge(
+            f"Instruction of {length} bytes larger than {max_size} bytes"
+        )
+    buffer = bytearray(length)
+    received = len(head) - match.end()
+    buffer[:received] = memoryview(head)[match.end() :]
+    del head
+    while received < length:
+        chunk = await reader.read(min(INSTRUCTION_READ_SIZE, length - received))
+        if not chunk:
+            raise ConnectionError(f"Instruction closed after {received}/{length} bytes")
+        buffer[received : received + len(chunk)] = chunk
+        received += len(chunk)
+    return buffer, True
+
+
+async def write_message(writer: asyncio.StreamWriter, message: Message, framed: bool):
+    """Write a message to the supervisor, prefixed with its length if `framed`."""
+    if framed:
+        writer.write(f"{sum(len(piece) for piece in message)}\n".encode())
+    for piece in message:
+        writer.write(piece)
+        await writer.drain()
+
+
 async def process_instruction(
     instruction: bytes,
     interface: Interface,
     application: Union[ASGIApplication, subprocess.Popen],
-) -> AsyncIterable[bytes]:
+    http_session: Optional[aiohttp.ClientSession] = None,
+    readiness: Optional[Readiness] = None,
+    request_slots: Optional[asyncio.Semaphore] = None,
+) -> AsyncIterable[Message]:
     if instruction == b"halt":
         logger.info("Received halt command")
         system("sync")
@@ -381,6 +709,8 @@ async def process_instruction(
         if isinstance(application, subprocess.Popen):
             application.terminate()
             logger.debug("Application terminated")
+            if http_session:
+                await http_session.close()
             # application.communicate()
         else:
             # Close the cached session in aleph_client:
@@ -389,7 +719,7 @@ async def process_instruction(
             session: aiohttp.ClientSession = get_fallback_session()
             await session.close()
             logger.debug("Aiohttp cached session closed")
-        yield b"STOP\n"
+        yield [b"STOP\n"]
         logger.debug("Supervisor informed of halt")
         raise ShutdownException
     elif instruction.startswith(b"!"):
@@ -399,13 +729,15 @@ async def process_instruction(
             process_output = subprocess.check_output(
                 msg, stderr=subprocess.STDOUT, shell=True
             )
-            yield process_output
+            yield [process_output]
         except subprocess.CalledProcessError as error:
-            yield str(error).encode() + b"\n" + error.output
+            yield [str(error).encode() + b"\n" + error.output]
     else:
         # Python
         logger.debug("msgpack.loads (")
         msg_ = msgpack.loads(instruction, raw=False)
+        # Only the decoded request is kept while the program runs
+        del instruction
         logger.debug("msgpack.loads )")
         payload = RunCodePayload(**msg_)
 
@@ -416,12 +748,14 @@ async def process_instruction(
             output_data: Optional[bytes]
 
             if interface == Interface.asgi:
-                headers, body, output, output_data = await run_python_code_http(
-                    application=application, scope=payload.scope
-                )
+                # Not limited without request slots
+                async with request_slots or asyncio.Semaphore():
+                    headers, body, output, output_data = await run_python_code_http(
+                        application=application, scope=payload.scope
+                    )
             elif interface == Interface.executable:
                 headers, body, output, output_data = await run_executable_http(
-                    scope=payload.scope
+                    scope=payload.scope, session=http_session, readiness=readiness
                 )
             else:
                 raise ValueError("Unknown interface. This should never happen")
@@ -432,41 +766,118 @@ async def process_instruction(
                 "output": output,
                 "output_data": output_data,
             }
-            yield msgpack.dumps(result, use_bin_type=True)
+            yield pack_response(result)
         except Exception as error:
-            yield msgpack.dumps(
-                {
-                    "error": str(error),
-                    "traceback": str(traceback.format_exc()),
-                    "output": output,
-                }
-            )
-
-
-def receive_data_length(client) -> int:
-    """Receive the length of the data to follow."""
-    buffer = b""
-    for _ in range(9):
-        byte = client.recv(1)
-        if byte == b"\n":
-            break
-        else:
-            buffer += byte
-    return int(buffer)
+            yield [
+                msgpack.dumps(
+                    {
+                        "error": str(error),
+                        "traceback": str(traceback.format_exc()),
+                        "output": output,
+                    }
+                )
+            ]
 
 
-def load_configuration(data: bytes) -> ConfigurationPayload:
-    msg_ = msgpack.loads(data, raw=False)
+def int_variable(variables: Optional[Dict[str, str]], name: str, default: int) -> int:
+    value = (variables or {}).get(name)
+    try:
+        return int(value) if value else default
+    except ValueError:
+        logger.warning(f"Invalid {name} {value!r}, ignored")
+        return default
+
+
+def max_concurrent_requests(variables: Optional[Dict[str, str]]) -> int:
+    return int_variable(
+        variables, "ALEPH_INIT_MAX_CONCURRENT_REQUESTS", MAX_CONCURRENT_REQUESTS
+    )
+
+
+def max_instruction_size(variables: Optional[Dict[str, str]]) -> int:
+    return int_variable(
+        variables, "ALEPH_INIT_MAX_INSTRUCTION_SIZE", MAX_INSTRUCTION_SIZE
+    )
+
+
+def receive_data_length(client) -> Tuple[int, bytes]:
+    """Receive the length of the data to follow, and the start of the data read with it."""
+    head = b""
+    while b"\n" not in head[:LENGTH_HEADER_SIZE]:
+        if len(head) >= LENGTH_HEADER_SIZE:
+            raise ValueError(f"Invalid length prefix {head[:LENGTH_HEADER_SIZE]!r}")
+        chunk = client.recv(FIRST_READ_SIZE)
+        if not chunk:
+            raise ConnectionError("Connection closed before the length prefix")
+        head += chunk
+    length, start = head.split(b"\n", 1)
+    return int(length), start
+
+
+def receive_frame(client) -> bytearray:
+    """Receive data prefixed with its length, into a buffer allocated once."""
+    length, start = receive_data_length(client)
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = len(start)
+    view[:received] = start
+    while received < length:
+        count = client.recv_into(view[received:])
+        if not count:
+            raise ConnectionError(f"Connection closed after {received}/{length} bytes")
+        received += count
+    view.release()
+    return buffer
+
+
+def unpack_value(view: memoryview, position: int) -> Tuple[Any, int]:
+    """Decode the msgpack value at a position, and return it with the position after it.
+
+    Binary values are views of the buffer, the others are decoded by small slices.
+    """
+    length_size = BIN_LENGTH_SIZES.get(view[position])
+    if length_size:
+        start = position + 1 + length_size
+        length = int.from_bytes(view[position + 1 : start], "big")
+        if start + length > len(view):
+            raise ValueError(f"Truncated configuration value at {position}")
+        return view[start : start + length], start + length
+
+    unpacker = msgpack.Unpacker(raw=False, read_size=CONFIG_VALUE_READ_SIZE)
+    fed = position
+    while True:
+        try:
+            value = unpacker.unpack()
+            return value, position + unpacker.tell()
+        except msgpack.OutOfData:
+            if fed >= len(view):
+                raise ValueError(f"Truncated configuration value at {position}")
+            unpacker.feed(view[fed : fed + CONFIG_VALUE_READ_SIZE])
+            fed += CONFIG_VALUE_READ_SIZE
+
+
+def load_configuration(data: Union[bytes, bytearray]) -> ConfigurationPayload:
+    # The map is walked in the buffer, code and input data are views of it and are
+    # written to their files without being copied
+    view = memoryview(data)
+    if 0x80 <= view[0] <= 0x8F:
+        count, position = view[0] & 0x0F, 1
+    elif view[0] == 0xDE:
+        count, position = struct.unpack_from(">H", view, 1)[0], 3
+    elif view[0] == 0xDF:
+        count, position = struct.unpack_from(">I", view, 1)[0], 5
+    else:
+        raise ValueError("The configuration is not a msgpack map")
+    msg_ = {}
+    for _ in range(count):
+        key, position = unpack_value(view, position)
+        msg_[key], position = unpack_value(view, position)
     msg_["volumes"] = [Volume(**volume_dict) for volume_dict in msg_.get("volumes")]
     return ConfigurationPayload(**msg_)
 
 
 def receive_config(client) -> ConfigurationPayload:
-    length = receive_data_length(client)
-    data = b""
-    while len(data) < length:
-        data += client.recv(1024 * 1024)
-    return load_configuration(data)
+    return load_configuration(receive_frame(client))
 
 
 def setup_system(config: ConfigurationPayload):
@@ -492,16 +903,33 @@ def umount_volumes(volumes: List[Volume]):
 
 
 async def main() -> None:
+    s = open_host_socket()
     client, addr = s.accept()
 
     logger.debug("Receiving setup...")
     config = receive_config(client)
     setup_system(config)
 
+    # Connections to executable programs are reused by all the requests
+    http_session: Optional[aiohttp.ClientSession] = None
+    readiness: Optional[Readiness] = None
+    request_slots = asyncio.Semaphore(max_concurrent_requests(config.variables))
+    instruction_max_size = max_instruction_size(config.variables)
     try:
         app: Union[ASGIApplication, subprocess.Popen] = setup_code(
             config.code, config.encoding, config.entrypoint, config.interface
         )
+        if config.interface == Interface.executable:
+            http_settings = HTTPClientSettings.from_variables(config.variables)
+            http_session = http_settings.session()
+            readiness = Readiness(app, http_settings, http_session)
+            # Programs not ready by then keep being probed, requests wait for them
+            if not await readiness.wait(http_settings.ready_timeout):
+                if app.poll() is not None:
+                    raise RuntimeError(
+                        f"Program exited with code {app.returncode} before being ready"
+                    )
+                logger.warning("Program not ready, reporting its start anyway")
         client.send(msgpack.dumps({"success": True}))
     except Exception as error:
         client.send(
@@ -516,6 +944,10 @@ async def main() -> None:
         logger.exception("Program could not be started")
         raise
 
+    # Both are on disk or loaded by now, their memory is given back to the program
+    config.code = None
+    config.input_data = None
+
     class ServerReference:
         "Reference used to close the server from within `handle_instruction"
         server: asyncio.AbstractServer
@@ -523,25 +955,39 @@ async def main() -> None:
     server_reference = ServerReference()
 
     async def handle_instruction(reader, writer):
-        data = await reader.read(1000_1000)  # Max 1 Mo
+        try:
+            data, framed = await read_instruction(reader, instruction_max_size)
+        except InstructionTooLarge as error:
+            logger.error(str(error))
+            response = msgpack.dumps(
+                {"error": str(error), "traceback": "", "output": None}
+            )
+            await write_message(writer, [response], framed=True)
+            writer.close()
+            return
 
         logger.debug("Init received msg")
         if logger.level <= logging.DEBUG:
             data_to_print = f"{data[:500]}..." if len(data) > 500 else data
             logger.debug(f"<<<\n\n{data_to_print}\n\n>>>")
 
+        results = process_instruction(
+            instruction=data,
+            interface=config.interface,
+            application=app,
+            http_session=http_session,
+            readiness=readiness,
+            request_slots=request_slots,
+        )
+        del data
         try:
-            async for result in process_instruction(
-                instruction=data, interface=config.interface, application=app
-            ):
-                writer.write(result)
-                await writer.drain()
+            async for result in results:
+                await write_message(writer, result, framed)
 
                 logger.debug("Instruction processed")
         except ShutdownException:
             logger.info("Initiating shutdown")
-            writer.write(b"STOPZ\n")
-            await writer.drain()
+            await write_message(writer, [b"STOPZ\n"], framed)
             logger.debug("Shutdown confirmed to supervisor")
             server_reference.server.close()
             logger.debug("Supervisor socket server closed")
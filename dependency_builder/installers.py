@@ -0,0 +1,227 @@
+"""
+Package managers the volumes are installed with. pip and npm are the defaults, uv and
+pnpm install the same trees faster and are replaced by pip and npm where they are not
+installed.
+"""
+import json
+import logging
+import shlex
+import shutil
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Type
+
+from artifacts import artifact_cache
+from manifests import normalize_requirements, resolved_python_requirements
+from targets import PYTHON_INTERPRETER, Target
+
+logger = logging.getLogger(__name__)
+
+# Architectures of the wheel platform tags, e.g. manylinux2014_aarch64
+PLATFORM_ARCHITECTURES = ("x86_64", "aarch64")
+# Flat node_modules, as npm lays them out. Files are copied out of the store (cloned
+# where the filesystem allows it), the volume is modified in place after the install.
+PNPM_LAYOUT_OPTIONS = (
+    "--config.node-linker=hoisted --config.package-import-method=clone-or-copy"
+)
+
+
+class PythonInstaller:
+    """Installs Python requirements for a target into a directory with pip."""
+
+    name = "pip"
+    executable = "pip"
+
+    def __init__(self, target: Target):
+        self.target = target
+        # Interpreter of the builder, that runs the installs for all the targets
+        self.python = PYTHON_INTERPRETER
+
+    def target_options(self) -> str:
+        """Options installing for another Python version or platform than the builder's.
+
+        Only wheels can be installed for them, and their bytecode is not compiled by the
+        interpreter of the builder.
+        """
+        if self.target.native:
+            return ""
+        options = [
+            f"--python-version {self.target.version}",
+            "--implementation cp",
+            "--only-binary=:all:",
+            "--no-compile",
+        ]
+        if self.target.platform:
+            options.append(f"--platform {self.target.platform}")
+        return " ".join(options)
+
+    def available(self) -> bool:
+        return shutil.which(self.executable) is not None
+
+    def install_command(
+        self, destination: Path, arguments: List[str], no_deps: bool = False
+    ) -> str:
+        """Installs requirements, given as shell-quoted arguments, into `destination`."""
+        return (
+            f"pip install {artifact_cache.pip_options()} {self.target_options()} "
+            f"{'--no-deps' if no_deps else ''} -t {str(destination)} {' '.join(arguments)}"
+        )
+
+    def resolve_command(self, requirements_path: Path, output_path: Path) -> str:
+        """Resolves a requirements file without installing it, into `output_path`."""
+        return (
+            f"pip install {artifact_cache.pip_options()} {self.target_options()} "
+            f"--dry-run --ignore-installed --quiet --report {str(output_path)} -r {str(requirements_path)}"
+        )
+
+    def resolved_requirements(self, output: str) -> List[str]:
+        """Pinned requirements of the output of the resolve command."""
+        return resolved_python_requirements(json.loads(output))
+
+
+class UvPythonInstaller(PythonInstaller):
+    """Installs Python requirements with uv, which resolves and installs in parallel."""
+
+    name = "uv"
+    executable = "uv"
+
+    def python_options(self) -> str:
+        # The interpreter of the builder must be installed, uv would download another one
+        return f"--python {self.python} --no-python-downloads"
+
+    def target_options(self) -> str:
+        if self.target.native:
+            # uv does not compile the bytecode by default, unlike pip
+            return "--compile-bytecode"
+        options = [f"--python-version {self.target.version}"]
+        if self.target.platform:
+            options.append(f"--python-platform {uv_platform(self.target.platform)}")
+        return " ".join(options)
+
+    def install_command(
+        self, destination: Path, arguments: List[str], no_deps: bool = False
+    ) -> str:
+        return (
+            f"uv pip install {artifact_cache.uv_options()} {self.python_options()} "
+            f"{self.target_options()} {'--no-deps' if no_deps else ''} "
+            f"--target {str(destination)} {' '.join(arguments)} "
+            # Lock file of uv, that would end up in the volume
+            f"&& rm -f {str(destination / '.lock')}"
+        )
+
+    def resolve_command(self, requirements_path: Path, output_path: Path) -> str:
+        return (
+            f"uv pip compile {artifact_cache.uv_options()} {self.python_options()} "
+            f"{'' if self.target.native else self.target_options()} --quiet --no-header --no-annotate -o {str(output_path)} {str(requirements_path)}"
+        )
+
+    def resolved_requirements(self, output: str) -> List[str]:
+        return normalize_requirements(output.split("\n"))
+
+    def universal_resolve_command(
+        self, requirements_path: Path, output_path: Path, python_version: str
+    ) -> str:
+        """Resolves a requirements file once for all the platforms and the Python
+        versions from `python_version`, with environment markers.
+        """
+        return (
+            f"uv pip compile {artifact_cache.uv_options()} {self.python_options()} "
+            f"--universal --python-version {python_version} --quiet --no-header "
+            f"--no-annotate -o {str(output_path)} {str(requirements_path)}"
+        )
+
+
+class NodeInstaller:
+    """Installs Node.js modules with npm."""
+
+    name = "npm"
+    executable = "npm"
+
+    def available(self) -> bool:
+        return shutil.which(self.executable) is not None
+
+    def install_modules_command(self, prefix: Path, arguments: List[str]) -> str:
+        """Installs modules, given as shell-quoted arguments, into `modules_path(prefix)`."""
+        # Global install into the prefix instead of /usr/local, keeping the global layout
+        return (
+            f"npm install {artifact_cache.npm_options()} -g --prefix {str(prefix)} "
+            f"{' '.join(arguments)}"
+        )
+
+    def modules_path(self, prefix: Path) -> Path:
+        return prefix / "lib" / "node_modules"
+
+    def install_package_command(self, directory: Path) -> str:
+        """Installs the dependencies of the package.json of a directory."""
+        return f"cd {str(directory)} && npm install {artifact_cache.npm_options()}"
+
+
+class PnpmNodeInstaller(NodeInstaller):
+    """Installs Node.js modules with pnpm, out of its content-addressable store."""
+
+    name = "pnpm"
+    executable = "pnpm"
+
+    def install_modules_command(self, prefix: Path, arguments: List[str]) -> str:
+        directory = prefix / "lib"
+        return (
+            f"mkdir -p {str(directory)} && pnpm add {artifact_cache.pnpm_options()} "
+            f"{PNPM_LAYOUT_OPTIONS} --dir {str(directory)} {' '.join(arguments)}"
+        )
+
+    def install_package_command(self, directory: Path) -> str:
+        return (
+            f"cd {str(directory)} && pnpm install {artifact_cache.pnpm_options()} "
+            f"{PNPM_LAYOUT_OPTIONS}"
+        )
+
+
+PYTHON_INSTALLERS: Dict[str, Type[PythonInstaller]] = {
+    "pip": PythonInstaller,
+    "uv": UvPythonInstaller,
+}
+NODE_INSTALLERS: Dict[str, Type[NodeInstaller]] = {
+    "npm": NodeInstaller,
+    "pnpm": PnpmNodeInstaller,
+}
+
+
+def requirement_arguments(lines: List[str]) -> List[str]:
+    """Shell-quoted arguments of requirements lines.
+
+    Option lines (`--extra-index-url URL`, `-e URL`...) are split into their arguments,
+    requirements are passed whole.
+    """
+    return [
+        shlex.quote(argument)
+        for line in lines
+        for argument in (shlex.split(line) if line.startswith("-") else [line])
+    ]
+
+
+def uv_platform(platform: str) -> str:
+    """uv name of a wheel platform tag, e.g. aarch64-manylinux2014 for manylinux2014_aarch64."""
+    for architecture in PLATFORM_ARCHITECTURES:
+        if platform.endswith(f"_{architecture}"):
+            return f"{architecture}-{platform[:-len(architecture) - 1]}"
+    return platform
+
+
+@lru_cache()
+def python_installer(name: str, target: Target) -> PythonInstaller:
+    """The Python installer backend of a name for a target, or pip if it is not installed."""
+    installer = PYTHON_INSTALLERS[name](target)
+    if not installer.available():
+        logger.warning(f"{installer.executable} is not installed, installing with pip")
+        return PythonInstaller(target)
+    return installer
+
+
+@lru_cache()
+def node_installer(name: str) -> NodeInstaller:
+    """The Node.js installer backend of a name, or npm if it is not installed."""
+    installer = NODE_INSTALLERS[name]()
+    if not installer.available():
+        logger.warning(f"{installer.executable} is not installed, installing with npm")
+        return NodeInstaller()
+    return installer
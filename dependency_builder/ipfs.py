@@ -0,0 +1,317 @@
+import asyncio
+import ctypes
+import logging
+import os
+import subprocess
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aioipfs
+from fastapi import HTTPException
+
+from conf import settings
+from utils import CID, Multiaddr
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EndpointStats:
+    uploads: int = 0
+    failures: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    # Of the last successful upload, in bytes per second
+    throughput: float = 0.0
+
+
+def raise_no_cid():
+    raise ValueError("Could not obtain a CID")
+
+
+def path_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+    return path.stat().st_size
+
+
+class IPFSPool:
+    """Long-lived clients of a list of IPFS nodes.
+
+    Uploads are retried with an exponential backoff. They go to the first node that
+    accepts them, or to all the nodes when `fan_out` is set. They are chunked with
+    `chunker` and `raw_leaves`, or with the defaults of the nodes.
+    """
+
+    def __init__(
+        self,
+        multiaddrs: List[Multiaddr],
+        retries: int,
+        backoff: float,
+        timeout: float,
+        fan_out: bool = False,
+        chunker: Optional[str] = None,
+        raw_leaves: bool = False,
+    ):
+        if not multiaddrs:
+            raise ValueError("No IPFS nodes configured, see BUILDER_IPFS_MULTIADDRS")
+        self.multiaddrs = multiaddrs
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.fan_out = fan_out
+        self.chunker = chunker
+        self.raw_leaves = raw_leaves
+        self.endpoint_stats: Dict[Multiaddr, EndpointStats] = {
+            multiaddr: EndpointStats() for multiaddr in multiaddrs
+        }
+        self._clients: Dict[Multiaddr, aioipfs.AsyncIPFS] = {}
+
+    @property
+    def default_chunking(self) -> bool:
+        """Whether uploads get the CIDs that `ipfs add` gives with its default settings."""
+        return self.chunker is None and not self.raw_leaves
+
+    def add_options(self) -> dict:
+        options = {}
+        if self.chunker:
+            options["chunker"] = self.chunker
+        if self.raw_leaves:
+            options["raw_leaves"] = True
+        return options
+
+    def client(self, multiaddr: Optional[Multiaddr] = None) -> aioipfs.AsyncIPFS:
+        """Returns the client of a node, the first one by default."""
+        multiaddr = multiaddr or self.multiaddrs[0]
+        if multiaddr not in self._clients:
+            # Created lazily, its connection pool is bound to the running event loop
+            self._clients[multiaddr] = aioipfs.AsyncIPFS(
+                maddr=multiaddr,
+                conns_max=settings.IPFS_MAX_CONNECTIONS,
+                conns_max_per_host=settings.IPFS_MAX_CONNECTIONS,
+            )
+        return self._clients[multiaddr]
+
+    async def _add_once(self, multiaddr: Multiaddr, path: Path) -> CID:
+        stats = self.endpoint_stats[multiaddr]
+        size = path_size(path)
+        start = time.monotonic()
+        try:
+            cid = None
+            async for added_file in self.client(multiaddr).add(
+                path, recursive=True, **self.add_options()
+            ):
+                logger.debug(
+                    f"Uploaded file {added_file['Name']} to {multiaddr} with CID: {added_file['Hash']}"
+                )
+                cid = added_file["Hash"]
+            # The last CID is the CID of the directory uploaded
+            cid = cid or raise_no_cid()
+        except Exception:
+            stats.failures += 1
+            raise
+        elapsed = time.monotonic() - start
+        stats.uploads += 1
+        stats.bytes += size
+        stats.seconds += elapsed
+        stats.throughput = size / elapsed if elapsed else 0
+        logger.info(
+            f"Uploaded {size} bytes to {multiaddr} in {elapsed:.1f}s "
+            f"({stats.throughput / 1024**2:.1f} MiB/s)"
+        )
+        return CID(cid)
+
+    async def _add_with_retries(self, multiaddrs: List[Multiaddr], path: Path) -> CID:
+        """Tries each node in turn, then waits before starting over."""
+        error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            for multiaddr in multiaddrs:
+                try:
+                    return await asyncio.wait_for(
+                        self._add_once(multiaddr, path), timeout=self.timeout
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"Upload of {path} to {multiaddr} failed (attempt {attempt + 1}): {e!r}"
+                    )
+                    error = e
+        raise error
+
+    async def add(self, path: Path) -> CID:
+        """Uploads a file or a directory and returns its CID."""
+        if not self.fan_out:
+            return await self._add_with_retries(self.multiaddrs, path)
+
+        results = await asyncio.gather(
+            *(
+                self._add_with_retries([multiaddr], path)
+                for multiaddr in self.multiaddrs
+            ),
+            return_exceptions=True,
+        )
+        cids = {result for result in results if not isinstance(result, Exception)}
+        if not cids:
+            raise results[0]
+        if len(cids) > 1:
+            logger.warning(f"Nodes returned different CIDs for {path}: {cids}")
+        return CID(next(iter(cids)))
+
+    async def is_pinned(self, cid: CID) -> Optional[bool]:
+        """Checks whether a CID is pinned on any of the nodes.
+
+        Returns None when it is not pinned on the nodes that could be asked, but some
+        of them could not, so that it is not known whether it is pinned.
+        """
+        unknown = False
+        for multiaddr in self.multiaddrs:
+            try:
+                pins = await self.client(multiaddr).pin.ls(path=cid, quiet=True)
+                if cid in pins.get("Keys", {}):
+                    return True
+            except aioipfs.APIError as e:
+                # Error of `pin ls` for a CID not pinned
+                if "is not pinned" not in e.message:
+                    logger.warning(
+                        f"Could not check whether {cid} is pinned on {multiaddr}: {e.message}"
+                    )
+                    unknown = True
+            except Exception as e:
+                logger.warning(
+                    f"Could not check whether {cid} is pinned on {multiaddr}: {e}"
+                )
+                unknown = True
+        return None if unknown else False
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            multiaddr: asdict(stats) for multiaddr, stats in self.endpoint_stats.items()
+        }
+
+
+ipfs_pool = IPFSPool(
+    multiaddrs=[Multiaddr(multiaddr) for multiaddr in settings.IPFS_MULTIADDRS],
+    retries=settings.IPFS_RETRIES,
+    backoff=settings.IPFS_RETRY_BACKOFF,
+    timeout=settings.IPFS_UPLOAD_TIMEOUT,
+    fan_out=settings.IPFS_FAN_OUT,
+    chunker=settings.IPFS_CHUNKER,
+    raw_leaves=settings.IPFS_RAW_LEAVES,
+)
+
+
+async def upload_sources(
+    path: Path,
+    logger: logging.Logger = logging.getLogger(__name__),
+) -> CID:
+    """Uploads a file to IPFS and returns the StoreMessage."""
+    logger.debug(f"Uploading {path} to IPFS...")
+    try:
+        cid = await ipfs_pool.add(path)
+    except Exception as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Could not upload {path} to IPFS: {e}",
+        )
+    return cid
+
+
+async def stream_sources(
+    path: Path,
+    writer: "asyncio.Future",
+    logger: logging.Logger = logging.getLogger(__name__),
+) -> CID:
+    """Uploads a file to IPFS while it is being written."""
+    logger.debug(f"Streaming {path} to IPFS...")
+    try:
+        cid = await stream_file_to_ipfs(path, writer, logger=logger)
+    except subprocess.SubprocessError:
+        # Failures of the writer are not upload errors
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Could not upload {path} to IPFS: {e}",
+        )
+    return cid
+
+
+def punch_hole(fd: int, offset: int, length: int) -> None:
+    """Releases the disk space of a range of a file, best effort."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE
+        libc.fallocate(
+            fd, 0x02 | 0x01, ctypes.c_longlong(offset), ctypes.c_longlong(length)
+        )
+    except (OSError, AttributeError):
+        pass
+
+
+async def stream_file_to_ipfs(
+    path: Path,
+    writer: "asyncio.Future",
+    header_size: int = settings.STREAM_UPLOAD_HEADER_SIZE,
+    chunk_size: int = settings.STREAM_UPLOAD_CHUNK_SIZE,
+    logger: logging.Logger = logging.getLogger(__name__),
+) -> CID:
+    """Uploads a file to IPFS while `writer` is still writing it.
+
+    The file must be written sequentially, except for its first `header_size` bytes
+    that are uploaded again once the writer is done. The content is appended to a
+    temporary MFS file of the first node that is pinned at the end, and the ranges
+    already uploaded are released from the local disk.
+    """
+    client = ipfs_pool.client()
+    mfs_path = f"/builds/{uuid.uuid4().hex}"
+    offset = 0
+    try:
+        while not path.exists():
+            if writer.done():
+                # The writer failed or finished without creating the file
+                await writer
+                raise FileNotFoundError(f"No such file: {path}")
+            await asyncio.sleep(0.1)
+        # Opened for writing as well, which releasing disk space requires
+        with open(path, "r+b") as fd:
+            while True:
+                finished = writer.done()
+                size = os.fstat(fd.fileno()).st_size
+                while size - offset >= chunk_size or (finished and offset < size):
+                    fd.seek(offset)
+                    data = fd.read(min(chunk_size, size - offset))
+                    await client.files.write(
+                        mfs_path, data, create=True, parents=True, offset=offset
+                    )
+                    released = max(offset, header_size)
+                    offset += len(data)
+                    if offset > released:
+                        punch_hole(fd.fileno(), released, offset - released)
+                if finished:
+                    break
+                await asyncio.sleep(0.1)
+            await writer
+
+            fd.seek(0)
+            header = fd.read(header_size)
+            await client.files.write(mfs_path, header)
+
+        cid = (await client.files.stat(mfs_path))["Hash"]
+        async for _ in client.pin.add(cid):
+            pass
+        logger.debug(f"Streamed {path} to IPFS with CID: {cid}")
+        return cid
+    finally:
+        try:
+            await client.files.rm(mfs_path, force=True)
+        except Exception as e:
+            logger.debug(f"Could not remove {mfs_path} from MFS: {e}")
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import AsyncIterator, Awaitable, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from conf import settings
+from utils import CID, build_log
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    success = "success"
+    failed = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    status: JobStatus = JobStatus.pending
+    cid: Optional[CID] = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    # Last log lines, and the number of earlier ones dropped to keep them bounded
+    logs: Deque[str] = field(
+        default_factory=lambda: deque(maxlen=settings.JOBS_MAX_LOG_LINES)
+    )
+    dropped_logs: int = 0
+    # Set and replaced every time the job is updated, to wake up log followers
+    _updated: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.success, JobStatus.failed)
+
+    def notify(self) -> None:
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def log(self, line: str) -> None:
+        if len(self.logs) == self.logs.maxlen:
+            self.dropped_logs += 1
+        self.logs.append(line)
+        self.notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yields the log lines of the job, waiting for new ones until it is done."""
+        # Position in all the lines logged, dropped ones included
+        position = 0
+        while True:
+            updated = self._updated
+            if position < self.dropped_logs:
+                yield f"[{self.dropped_logs - position} lines dropped]"
+                position = self.dropped_logs
+            while position < self.dropped_logs + len(self.logs):
+                yield self.logs[position - self.dropped_logs]
+                position += 1
+            if self.done:
+                return
+            await updated.wait()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "cid": self.cid,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    """Runs builds in the background, independently of the requests that submitted them."""
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.jobs: Dict[str, Job] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, build: Awaitable[CID]) -> Job:
+        self.prune()
+        job = Job(id=uuid.uuid4().hex)
+        self.jobs[job.id] = job
+        self.tasks[job.id] = asyncio.create_task(self._run(job, build))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"No such job: {job_id}")
+        return job
+
+    async def _run(self, job: Job, build: Awaitable[CID]) -> None:
+        # Subprocesses started by this task forward their output to the job
+        build_log.set(job.log)
+        job.status = JobStatus.running
+        job.notify()
+        try:
+            job.cid = await build
+            job.status = JobStatus.success
+        except HTTPException as e:
+            job.error = str(e.detail)
+            job.status = JobStatus.failed
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.error = str(e)
+            job.status = JobStatus.failed
+        finally:
+            job.finished = time.time()
+            job.notify()
+            self.tasks.pop(job.id, None)
+
+    def prune(self) -> None:
+        """Forgets the jobs that finished more than `max_age` seconds ago."""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.done and now - job.finished > self.max_age:
+                del self.jobs[job_id]
+
+    def stats(self) -> Dict[str, int]:
+        stats = {status.value: 0 for status in JobStatus}
+        for job in self.jobs.values():
+            stats[job.status.value] += 1
+        return stats
+
+
+job_manager = JobManager(max_age=settings.JOBS_MAX_AGE)
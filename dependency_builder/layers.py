@@ -0,0 +1,162 @@
+"""
+Content-addressed store of the install trees of single Python distributions, shared
+by the builds: volumes are assembled from the layers of their pinned requirements, and
+only the layers missing from the store are installed.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from cache import SingleFlight
+from conf import settings
+from metrics import LAYER_LOOKUPS
+from utils import make_dependencies_hash, run_subprocess
+
+logger = logging.getLogger(__name__)
+
+# Layers used more recently than this are never evicted, builds may be assembling them
+EVICTION_GRACE_PERIOD = 3600  # seconds
+
+
+class PackageStore:
+    """Install trees of single distributions, keyed by target and pinned requirement.
+
+    Layers are directories named by their key, written once and never modified. The
+    least recently used ones are removed when the store is larger than `max_size`.
+    """
+
+    def __init__(self, path: Path, max_size: int, max_concurrent_installs: int):
+        self.path = path
+        self.max_size = max_size
+        self.max_concurrent_installs = max_concurrent_installs
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Size of the store measured during the last prune
+        self.size = 0
+        self.in_flight = SingleFlight()
+        # Created lazily to be bound to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._prune_task: Optional[asyncio.Task] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_installs)
+        return self._semaphore
+
+    @staticmethod
+    def layer_key(target: str, requirement: str, options: List[str]) -> str:
+        """Key of the layer of a pinned requirement, installed with package manager options."""
+        return make_dependencies_hash([target, *options, requirement])
+
+    async def layer(self, key: str, install: Callable[[Path], Awaitable[None]]) -> Path:
+        """Returns the directory of a layer, filling it with `install` if it is missing."""
+        path = self.path / key
+        if path.exists():
+            self.hits += 1
+            LAYER_LOOKUPS.labels(result="hit").inc()
+            # Marks the layer as recently used
+            os.utime(path)
+            return path
+
+        async def fill() -> Path:
+            self.misses += 1
+            LAYER_LOOKUPS.labels(result="miss").inc()
+            self.path.mkdir(parents=True, exist_ok=True)
+            # Hidden until complete, so that a failed install never becomes a layer
+            staging = Path(tempfile.mkdtemp(dir=self.path, prefix=f".{key}-"))
+            try:
+                async with self.semaphore:
+                    await install(staging)
+                staging.rename(path)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            return path
+
+        return await self.in_flight.run(key, fill)
+
+    async def assemble(self, layers: List[Path], destination: Path, link: bool) -> None:
+        """Merges layers into a directory, with hard links unless `link` is False.
+
+        Hard-linked files must not be modified in place, as they are the files of the store.
+        """
+        if not layers:
+            return
+        sources = " ".join(f"{str(layer)}/." for layer in layers)
+        await run_subprocess(
+            f"cp -a {'--link' if link else ''} -f {sources} {str(destination)}/"
+        )
+
+    def _layers(self) -> List[Path]:
+        if not self.path.exists():
+            return []
+        return [path for path in self.path.iterdir() if not path.name.startswith(".")]
+
+    def _prune(self) -> int:
+        """Removes the least recently used layers until the store fits in `max_size`."""
+        layers = []
+        for layer in self._layers():
+            try:
+                last_used = layer.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            size = sum(
+                os.lstat(os.path.join(root, name)).st_size
+                for root, _, names in os.walk(layer)
+                for name in names
+            )
+            layers.append((last_used, size, layer))
+        total = sum(size for _, size, _ in layers)
+        removed = 0
+        for last_used, size, layer in sorted(layers):
+            if (
+                total <= self.max_size
+                or time.time() - last_used < EVICTION_GRACE_PERIOD
+            ):
+                break
+            # Volumes already assembled hold hard links to the files, not the directories
+            shutil.rmtree(layer, ignore_errors=True)
+            total -= size
+            removed += size
+        self.size = total
+        return removed
+
+    async def prune(self) -> int:
+        """Prunes the store in a thread."""
+        start = time.monotonic()
+        removed = await asyncio.get_running_loop().run_in_executor(None, self._prune)
+        if removed:
+            logger.info(
+                f"Evicted {removed} bytes of package layers in {time.monotonic() - start:.1f}s"
+            )
+        self.evicted += removed
+        return removed
+
+    def schedule_prune(self) -> None:
+        """Prunes the store in the background, unless a prune is already running."""
+        if self._prune_task is None or self._prune_task.done():
+            self._prune_task = asyncio.ensure_future(self.prune())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "layers": len(self._layers()),
+            "size": self.size,
+            "max_size": self.max_size,
+            "evicted": self.evicted,
+        }
+
+
+package_store = PackageStore(
+    path=settings.PACKAGE_STORE_PATH,
+    max_size=settings.PACKAGE_STORE_MAX_SIZE,
+    max_concurrent_installs=settings.PACKAGE_STORE_MAX_CONCURRENT_INSTALLS,
+)
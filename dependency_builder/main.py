@@ -2,21 +2,41 @@
 This is the Aleph Console Backend VM. Its current primary purpose is to accept a list of python or node.js dependencies
 and to dependency_builder the according immutable IPFS volume.
 """
+import asyncio
+import json
 import logging
-import time
-from pathlib import Path
-from typing import List
+import subprocess
+from typing import Awaitable, Dict, List, Optional, TypeVar
 
 from aleph.sdk.vm.app import AlephApp
-from fastapi import FastAPI, File, UploadFile
+from fastapi import (Depends, FastAPI, File, HTTPException, Query, Request,
+                     UploadFile)
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.middleware.cors import CORSMiddleware
 
-from build import (build_and_upload_node_modules,
+from artifacts import artifact_cache
+from build import (BuildOptions, build_and_upload_node_matrix,
+                   build_and_upload_node_modules,
                    build_and_upload_node_package,
+                   build_and_upload_node_package_lock,
+                   build_and_upload_python_matrix,
                    build_and_upload_python_pipfile,
+                   build_and_upload_python_pipfile_lock,
+                   build_and_upload_python_poetry_lock,
                    build_and_upload_python_pyproject,
                    build_and_upload_python_requirements)
-from utils import CID, save_file
+from cache import build_cache, in_flight_builds, lockfile_cache
+from conf import settings
+from ipfs import ipfs_pool
+from jobs import job_manager
+from layers import package_store
+from pruning import Pruning
+from squashfs import Compression
+from targets import matrix_targets
+from uploads import MaxBodySizeMiddleware, read_upload
+from utils import CID
+from workspace import build_pool
 
 logger = (
     logging.getLogger(__name__)
@@ -24,6 +44,8 @@ logger = (
     else logging.getLogger("uvicorn")
 )
 http_app = FastAPI()
+# Added first, so that its responses also get the CORS headers
+http_app.add_middleware(MaxBodySizeMiddleware, max_size=settings.MAX_UPLOAD_SIZE)
 http_app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,6 +56,13 @@ http_app.add_middleware(
 
 app = AlephApp(http_app)
 
+T = TypeVar("T")
+
+
+@http_app.on_event("shutdown")
+async def close_ipfs_clients():
+    await ipfs_pool.close()
+
 
 @app.get("/")
 async def index():
@@ -45,53 +74,395 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Build metrics in the Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    """Hit/miss counters and size of the build cache and of the lockfile conversions."""
+    return {**build_cache.stats(), "lockfiles": lockfile_cache.stats()}
+
+
+@app.get("/cache/artifacts/stats")
+async def artifact_cache_stats() -> dict:
+    """Size of the package manager caches shared by the builds."""
+    return artifact_cache.stats()
+
+
+@app.get("/cache/packages/stats")
+async def package_store_stats() -> dict:
+    """Hit/miss counters and size of the store of package layers."""
+    return package_store.stats()
+
+
+@app.post("/cache/artifacts/python3.9")
+async def seed_python3_9(requirements: List[str]) -> dict:
+    """Pre-seed the wheelhouse with the wheels of python 3.9 requirements."""
+    try:
+        await artifact_cache.seed_wheelhouse(requirements)
+    except subprocess.CalledProcessError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unprocessable requirements: {e.stderr}",
+        )
+    return artifact_cache.stats()
+
+
+@app.post("/cache/artifacts/nodejs")
+async def seed_nodejs(modules: List[str]) -> dict:
+    """Pre-seed the npm cache with node.js modules and their dependencies."""
+    try:
+        await artifact_cache.seed_npm_cache(modules)
+    except subprocess.CalledProcessError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Invalid packages: {e.stderr}",
+        )
+    return artifact_cache.stats()
+
+
+@app.get("/ipfs/stats")
+async def ipfs_stats() -> dict:
+    """Uploads, failures and throughput of every IPFS node."""
+    return ipfs_pool.stats()
+
+
+@app.get("/pool/stats")
+async def pool_stats() -> dict:
+    """Number of builds running, waiting for a free slot and coalesced with an identical build."""
+    return {
+        **build_pool.stats(),
+        **in_flight_builds.stats(),
+        "jobs": job_manager.stats(),
+    }
+
+
+def build_options(
+    compression: Optional[Compression] = None,
+    reproducible: Optional[bool] = None,
+    precompile: Optional[bool] = None,
+    pruning: Optional[Pruning] = None,
+) -> BuildOptions:
+    """Options of a build, given as query parameters."""
+    return BuildOptions(
+        compression=compression or Compression(settings.COMPRESSION_PROFILE),
+        reproducible=(
+            settings.REPRODUCIBLE_BUILDS if reproducible is None else reproducible
+        ),
+        precompile=settings.PRECOMPILE_BYTECODE if precompile is None else precompile,
+        pruning=pruning or Pruning(settings.PRUNING),
+    )
+
+
+async def cancel_on_disconnect(request: Request, build: Awaitable[T]) -> T:
+    """Awaits a build, cancelling it if the client disconnects before it is done."""
+    task = asyncio.ensure_future(build)
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=1)
+            if not task.done() and await request.is_disconnected():
+                logger.info(f"Client of {request.url.path} disconnected, cancelling")
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        task.cancel()
+    return task.result()
+
+
+async def read_requirements(data_file: UploadFile) -> List[str]:
+    requirements = (await read_upload(data_file, settings.MAX_UPLOAD_SIZE)).split("\n")
+    return [r.strip() for r in requirements if r]
+
+
 @app.post("/build/python3.9")
-async def build_python3_9(requirements: List[str]) -> CID:
+async def build_python3_9(
+    request: Request,
+    requirements: List[str],
+    options: BuildOptions = Depends(build_options),
+) -> CID:
     """Build a python 3.9 environment."""
-    return await build_and_upload_python_requirements(requirements)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_requirements(requirements, options)
+    )
 
 
 @app.post("/build/python3.9/requirements")
 async def build_python3_9_requirements(
+    request: Request,
     data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
 ) -> CID:
     """Build a python 3.9 environment from a requirements.txt file."""
-    requirements = data_file.file.read().decode("utf-8").split("\n")
-    requirements = [r.strip() for r in requirements if r]
-    return await build_and_upload_python_requirements(requirements)
+    requirements = await read_requirements(data_file)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_requirements(requirements, options)
+    )
 
 
 @app.post("/build/python3.9/pipfile")
 async def build_python3_9_pipfile(
+    request: Request,
     data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
 ) -> CID:
     """Build a python 3.9 environment from a Pipfile file."""
-    path = Path(f"/opt/{str(time.time())}/Pipfile")
-    await save_file(data_file, path)
-    return await build_and_upload_python_pipfile(path)
+    pipfile = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_pipfile(pipfile, options)
+    )
 
 
 @app.post("/build/python3.9/pyproject")
 async def build_python3_9_pyproject(
+    request: Request,
     data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
 ) -> CID:
     """Build a python 3.9 environment from a pyproject.toml file."""
-    path = Path(f"/opt/{str(time.time())}/pyproject.toml")
-    await save_file(data_file, path)
-    return await build_and_upload_python_pyproject(path)
+    pyproject = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_pyproject(pyproject, options)
+    )
+
+
+@app.post("/build/python3.9/pipfile/lock")
+async def build_python3_9_pipfile_lock(
+    request: Request,
+    data_file: UploadFile = File(...),
+    lock_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> CID:
+    """Build a python 3.9 environment from a Pipfile and its Pipfile.lock, without resolving it."""
+    pipfile = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    pipfile_lock = await read_upload(lock_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_pipfile_lock(pipfile, pipfile_lock, options)
+    )
+
+
+@app.post("/build/python3.9/pyproject/lock")
+async def build_python3_9_pyproject_lock(
+    request: Request,
+    data_file: UploadFile = File(...),
+    lock_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> CID:
+    """Build a python 3.9 environment from a pyproject.toml and its poetry.lock, without resolving it."""
+    pyproject = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    poetry_lock = await read_upload(lock_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_poetry_lock(pyproject, poetry_lock, options)
+    )
 
 
 @app.post("/build/nodejs")
-async def build_nodejs(modules: List[str]) -> CID:
+async def build_nodejs(
+    request: Request,
+    modules: List[str],
+    options: BuildOptions = Depends(build_options),
+) -> CID:
     """Build a node.js environment."""
-    return await build_and_upload_node_modules(modules)
+    return await cancel_on_disconnect(
+        request, build_and_upload_node_modules(modules, options)
+    )
 
 
 @app.post("/build/nodejs/package")
 async def build_nodejs_package(
+    request: Request,
     data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
 ) -> CID:
     """Build a node.js environment from a package.json file."""
-    path = Path(f"/opt/{str(time.time())}/package.json")
-    await save_file(data_file, path)
-    return await build_and_upload_node_package(path)
+    packages = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_node_package(packages, options)
+    )
+
+
+@app.post("/build/nodejs/package/lock")
+async def build_nodejs_package_lock(
+    request: Request,
+    data_file: UploadFile = File(...),
+    lock_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> CID:
+    """Build a node.js environment from a package.json and its package-lock.json, without resolving it."""
+    packages = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    package_lock = await read_upload(lock_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_node_package_lock(packages, package_lock, options)
+    )
+
+
+@app.post("/build/matrix/python")
+async def build_python_matrix(
+    request: Request,
+    requirements: List[str],
+    targets: List[str] = Query(...),
+    options: BuildOptions = Depends(build_options),
+) -> Dict[str, CID]:
+    """Build python environments for several targets, e.g. python3.9 and python3.11-manylinux2014_aarch64."""
+    targets = matrix_targets(targets, "python")
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_matrix(requirements, targets, options)
+    )
+
+
+@app.post("/build/matrix/python/requirements")
+async def build_python_matrix_requirements(
+    request: Request,
+    data_file: UploadFile = File(...),
+    targets: List[str] = Query(...),
+    options: BuildOptions = Depends(build_options),
+) -> Dict[str, CID]:
+    """Build python environments for several targets from a requirements.txt file."""
+    targets = matrix_targets(targets, "python")
+    requirements = await read_requirements(data_file)
+    return await cancel_on_disconnect(
+        request, build_and_upload_python_matrix(requirements, targets, options)
+    )
+
+
+@app.post("/build/matrix/nodejs/package")
+async def build_nodejs_matrix_package(
+    request: Request,
+    data_file: UploadFile = File(...),
+    targets: List[str] = Query(...),
+    options: BuildOptions = Depends(build_options),
+) -> Dict[str, CID]:
+    """Build node.js environments for several targets, e.g. nodejs and nodejs18, from a package.json file."""
+    targets = matrix_targets(targets, "nodejs")
+    packages = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return await cancel_on_disconnect(
+        request, build_and_upload_node_matrix(packages, targets, options)
+    )
+
+
+@app.post("/jobs/python3.9")
+async def submit_python3_9(
+    requirements: List[str], options: BuildOptions = Depends(build_options)
+) -> dict:
+    """Submit the build of a python 3.9 environment as a background job."""
+    return job_manager.submit(
+        build_and_upload_python_requirements(requirements, options)
+    ).summary()
+
+
+@app.post("/jobs/python3.9/requirements")
+async def submit_python3_9_requirements(
+    data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a python 3.9 environment from a requirements.txt file as a background job."""
+    requirements = await read_requirements(data_file)
+    return job_manager.submit(
+        build_and_upload_python_requirements(requirements, options)
+    ).summary()
+
+
+@app.post("/jobs/python3.9/pipfile")
+async def submit_python3_9_pipfile(
+    data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a python 3.9 environment from a Pipfile file as a background job."""
+    pipfile = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return job_manager.submit(
+        build_and_upload_python_pipfile(pipfile, options)
+    ).summary()
+
+
+@app.post("/jobs/python3.9/pyproject")
+async def submit_python3_9_pyproject(
+    data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a python 3.9 environment from a pyproject.toml file as a background job."""
+    pyproject = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return job_manager.submit(
+        build_and_upload_python_pyproject(pyproject, options)
+    ).summary()
+
+
+@app.post("/jobs/python3.9/pipfile/lock")
+async def submit_python3_9_pipfile_lock(
+    data_file: UploadFile = File(...),
+    lock_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a python 3.9 environment from a Pipfile and its Pipfile.lock as a background job."""
+    pipfile = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    pipfile_lock = await read_upload(lock_file, settings.MAX_UPLOAD_SIZE)
+    return job_manager.submit(
+        build_and_upload_python_pipfile_lock(pipfile, pipfile_lock, options)
+    ).summary()
+
+
+@app.post("/jobs/python3.9/pyproject/lock")
+async def submit_python3_9_pyproject_lock(
+    data_file: UploadFile = File(...),
+    lock_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a python 3.9 environment from a pyproject.toml and its poetry.lock as a background job."""
+    pyproject = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    poetry_lock = await read_upload(lock_file, settings.MAX_UPLOAD_SIZE)
+    return job_manager.submit(
+        build_and_upload_python_poetry_lock(pyproject, poetry_lock, options)
+    ).summary()
+
+
+@app.post("/jobs/nodejs")
+async def submit_nodejs(
+    modules: List[str], options: BuildOptions = Depends(build_options)
+) -> dict:
+    """Submit the build of a node.js environment as a background job."""
+    return job_manager.submit(build_and_upload_node_modules(modules, options)).summary()
+
+
+@app.post("/jobs/nodejs/package")
+async def submit_nodejs_package(
+    data_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a node.js environment from a package.json file as a background job."""
+    packages = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    return job_manager.submit(
+        build_and_upload_node_package(packages, options)
+    ).summary()
+
+
+@app.post("/jobs/nodejs/package/lock")
+async def submit_nodejs_package_lock(
+    data_file: UploadFile = File(...),
+    lock_file: UploadFile = File(...),
+    options: BuildOptions = Depends(build_options),
+) -> dict:
+    """Submit the build of a node.js environment from a package.json and its package-lock.json as a background job."""
+    packages = await read_upload(data_file, settings.MAX_UPLOAD_SIZE)
+    package_lock = await read_upload(lock_file, settings.MAX_UPLOAD_SIZE)
+    return job_manager.submit(
+        build_and_upload_node_package_lock(packages, package_lock, options)
+    ).summary()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> dict:
+    """Status of a build job, with the CID of the volume once it succeeded."""
+    return job_manager.get(job_id).summary()
+
+
+@app.get("/jobs/{job_id}/logs")
+async def get_job_logs(job_id: str) -> StreamingResponse:
+    """Stream the output of a build job as server-sent events, until the job is done."""
+    job = job_manager.get(job_id)
+
+    async def events():
+        async for line in job.follow():
+            yield f"data: {line}\n\n"
+        yield f"event: {job.status.value}\ndata: {json.dumps(job.summary())}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,257 @@
+"""
+Canonical forms of the dependency manifests, so that equivalent manifests share the
+same dependencies hash, and thus the same build and CID.
+"""
+import json
+from typing import Any, Dict, Iterable, List
+
+from fastapi import HTTPException
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.specifiers import Specifier
+from packaging.utils import canonicalize_name, canonicalize_version
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# Fields of package.json that change what `npm install` puts in node_modules
+PACKAGE_JSON_FIELDS = [
+    "dependencies",
+    "devDependencies",
+    "optionalDependencies",
+    "peerDependencies",
+    "peerDependenciesMeta",
+    "bundleDependencies",
+    "bundledDependencies",
+    "overrides",
+    "workspaces",
+    "scripts",
+    "engines",
+    "os",
+    "cpu",
+]
+# npm scripts run by `npm install` in the root package
+INSTALL_SCRIPTS = ["preinstall", "install", "postinstall", "prepublish", "prepare"]
+
+
+def normalize_specifier(specifier: Specifier) -> str:
+    # The release segments of compatible releases set what they allow, `~=4.2.0` only
+    # allows 4.2.x while `~=4.2` allows 4.x, their trailing zeros are kept
+    if specifier.operator in ("===", "~=") or specifier.version.endswith(".*"):
+        return str(specifier)
+    return f"{specifier.operator}{canonicalize_version(specifier.version)}"
+
+
+def normalize_requirement(line: str) -> str:
+    """Canonical form of a PEP 508 requirement, e.g. `Requests == 2.31.0` is `requests==2.31`.
+
+    pip options (`-r`, `--index-url`...) and lines that are not valid requirements are
+    only stripped, pip reports the invalid ones.
+    """
+    line = line.strip()
+    if line.startswith("-"):
+        return line
+    try:
+        requirement = Requirement(line)
+    except InvalidRequirement:
+        return line
+    normalized = canonicalize_name(requirement.name)
+    if requirement.extras:
+        normalized += (
+            f"[{','.join(sorted(canonicalize_name(e) for e in requirement.extras))}]"
+        )
+    if requirement.url:
+        normalized += f" @ {requirement.url}"
+    else:
+        normalized += ",".join(
+            sorted(
+                normalize_specifier(specifier) for specifier in requirement.specifier
+            )
+        )
+    if requirement.marker:
+        normalized += f" ; {requirement.marker}"
+    return normalized
+
+
+def requirement_lines(lines: Iterable[str]) -> List[str]:
+    """Lines of a requirements.txt, without comments and blank lines."""
+    requirements = []
+    for line in lines:
+        # Comments start with a # preceded by a whitespace, as in URL fragments they do not
+        line = line.split(" #", 1)[0].strip()
+        if line and not line.startswith("#"):
+            requirements.append(line)
+    return requirements
+
+
+def normalize_requirements(lines: Iterable[str]) -> List[str]:
+    """Canonical requirements of a requirements.txt, without comments and duplicates."""
+    return sorted(set(map(normalize_requirement, requirement_lines(lines))))
+
+
+def canonical_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def normalize_dependency_table(table: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonicalizes the package names of a Pipfile or pyproject.toml dependency table."""
+    return {canonicalize_name(name): spec for name, spec in table.items()}
+
+
+def parse_toml(text: str, name: str) -> Dict[str, Any]:
+    try:
+        return tomllib.loads(text)
+    except tomllib.TOMLDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid {name}: {e}")
+
+
+def parse_json(text: str, name: str) -> Dict[str, Any]:
+    try:
+        document = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid {name}: {e}")
+    if not isinstance(document, dict):
+        raise HTTPException(status_code=422, detail=f"Invalid {name}: not an object")
+    return document
+
+
+def normalize_pipfile(pipfile: str) -> List[str]:
+    """Canonical form of the parts of a Pipfile that pipenv resolves."""
+    document = parse_toml(pipfile, "Pipfile")
+    normalized = {
+        "source": document.get("source", []),
+        "requires": document.get("requires", {}),
+        "packages": normalize_dependency_table(document.get("packages", {})),
+        "dev-packages": normalize_dependency_table(document.get("dev-packages", {})),
+    }
+    return [canonical_json(normalized)]
+
+
+def normalize_pyproject(pyproject: str) -> List[str]:
+    """Canonical form of the parts of a pyproject.toml that `poetry export` resolves."""
+    document = parse_toml(pyproject, "pyproject.toml")
+    poetry = document.get("tool", {}).get("poetry", {})
+    groups = {
+        group: normalize_dependency_table(content.get("dependencies", {}))
+        for group, content in poetry.get("group", {}).items()
+    }
+    normalized = {
+        "dependencies": normalize_dependency_table(poetry.get("dependencies", {})),
+        "dev-dependencies": normalize_dependency_table(
+            poetry.get("dev-dependencies", {})
+        ),
+        "group": groups,
+        "extras": poetry.get("extras", {}),
+        "source": poetry.get("source", []),
+        "project-dependencies": normalize_requirements(
+            document.get("project", {}).get("dependencies", [])
+        ),
+    }
+    return [canonical_json(normalized)]
+
+
+def reduce_package_json(package_json: str) -> Dict[str, Any]:
+    """Keeps the fields of a package.json that change the installed modules."""
+    document = parse_json(package_json, "package.json")
+    reduced = {
+        field: document[field] for field in PACKAGE_JSON_FIELDS if field in document
+    }
+    if "scripts" in reduced:
+        reduced["scripts"] = {
+            name: script
+            for name, script in reduced["scripts"].items()
+            if name in INSTALL_SCRIPTS
+        }
+    return reduced
+
+
+def normalize_package_json(package_json: str) -> List[str]:
+    """Canonical form of the parts of a package.json that npm installs."""
+    return [canonical_json(reduce_package_json(package_json))]
+
+
+def normalize_modules(modules: Iterable[str]) -> List[str]:
+    """npm package specs, without blanks and duplicates."""
+    return sorted({module.strip() for module in modules if module.strip()})
+
+
+def resolved_python_requirements(report: Dict[str, Any]) -> List[str]:
+    """Pinned requirements of the packages in a `pip install --report` report."""
+    requirements = []
+    for item in report["install"]:
+        name = canonicalize_name(item["metadata"]["name"])
+        download_info = item["download_info"]
+        if not item.get("is_direct"):
+            requirements.append(f"{name}=={item['metadata']['version']}")
+        elif "vcs_info" in download_info:
+            vcs_info = download_info["vcs_info"]
+            requirements.append(
+                f"{name} @ {vcs_info['vcs']}+{download_info['url']}@{vcs_info['commit_id']}"
+            )
+        else:
+            requirements.append(f"{name} @ {download_info['url']}")
+    return sorted(requirements)
+
+
+def resolved_node_modules(package_lock: Dict[str, Any]) -> List[str]:
+    """Modules of a package-lock.json, with their resolved versions and integrity."""
+    packages = package_lock.get("packages")
+    if packages is None:
+        # Lockfile version 1, nested dependencies
+        return [canonical_json(package_lock.get("dependencies", {}))]
+    return sorted(
+        f"{path} {entry.get('version', '')} {entry.get('resolved', '')} {entry.get('integrity', '')}"
+        for path, entry in packages.items()
+        # The root package itself
+        if path
+    )
+
+
+def locked_requirement(name: str, entry: Dict[str, Any]) -> str:
+    """Requirement of a package of a Pipfile.lock, as `pipenv requirements` writes it."""
+    extras = f"[{','.join(entry['extras'])}]" if entry.get("extras") else ""
+    if "git" in entry:
+        ref = f"@{entry['ref']}" if "ref" in entry else ""
+        requirement = f"{name}{extras} @ git+{entry['git']}{ref}"
+    elif "file" in entry:
+        requirement = f"{name}{extras} @ {entry['file']}"
+    elif "version" in entry:
+        requirement = f"{name}{extras}{entry['version']}"
+    else:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Invalid Pipfile.lock: {name} is not a pinned version, a file or a git reference",
+        )
+    if entry.get("markers"):
+        requirement += f" ; {entry['markers']}"
+    return requirement
+
+
+def pipfile_lock_requirements(pipfile: str, pipfile_lock: str) -> List[str]:
+    """Requirements of the default packages of a Pipfile.lock, with its package indexes.
+
+    Fails if packages of the Pipfile are missing from the lockfile. Its hash of the
+    Pipfile is not checked, as it changes with the version of pipenv.
+    """
+    lock = parse_json(pipfile_lock, "Pipfile.lock")
+    locked = lock.get("default", {})
+    missing = set(
+        normalize_dependency_table(parse_toml(pipfile, "Pipfile").get("packages", {}))
+    ) - set(normalize_dependency_table(locked))
+    if missing:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Pipfile.lock is out of date, missing {', '.join(sorted(missing))}",
+        )
+    indexes = [
+        source["url"]
+        for source in lock.get("_meta", {}).get("sources", [])
+        if "url" in source
+    ]
+    options = [f"--index-url {url}" for url in indexes[:1]] + [
+        f"--extra-index-url {url}" for url in indexes[1:]
+    ]
+    return options + normalize_requirements(
+        locked_requirement(name, entry) for name, entry in locked.items()
+    )
@@ -0,0 +1,93 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Histogram
+
+# Builds take from seconds to tens of minutes
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+SIZE_BUCKETS = tuple(2**power for power in range(16, 35, 2))  # 64 KiB to 16 GiB
+
+BUILD_DURATION = Histogram(
+    "builder_build_duration_seconds",
+    "Duration of the builds, from the start of the install to the end of the upload",
+    ["target"],
+    buckets=DURATION_BUCKETS,
+)
+PHASE_DURATION = Histogram(
+    "builder_phase_duration_seconds",
+    "Duration of each phase of the builds",
+    ["target", "phase"],
+    buckets=DURATION_BUCKETS,
+)
+INSTALLER_DURATION = Histogram(
+    "builder_installer_duration_seconds",
+    "Duration of the resolve and install phases, by installer backend",
+    ["target", "installer", "phase"],
+    buckets=DURATION_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "builder_queue_wait_seconds",
+    "Time spent by builds waiting for a free slot",
+    buckets=DURATION_BUCKETS,
+)
+VOLUME_SIZE = Histogram(
+    "builder_volume_size_bytes",
+    "Size of the squashfs images produced",
+    ["target"],
+    buckets=SIZE_BUCKETS,
+)
+PRUNED_BYTES = Counter(
+    "builder_pruned_bytes",
+    "Bytes removed from the installed trees before squashing them",
+    ["target"],
+)
+UPLOADED_BYTES = Counter(
+    "builder_uploaded_bytes",
+    "Bytes uploaded to IPFS",
+    ["target"],
+)
+SKIPPED_UPLOADS = Counter(
+    "builder_skipped_uploads",
+    "Reproducible volumes not uploaded, as their predicted CID was already pinned",
+    ["target"],
+)
+CACHE_LOOKUPS = Counter(
+    "builder_cache_lookups",
+    "Lookups in the build cache",
+    ["result"],
+)
+LAYER_LOOKUPS = Counter(
+    "builder_layer_lookups",
+    "Lookups of package layers in the package store",
+    ["result"],
+)
+COALESCED_BUILDS = Counter(
+    "builder_coalesced_builds",
+    "Requests served by an identical build already in progress",
+)
+
+
+@contextmanager
+def measure_phase(target: str, phase: str) -> Iterator[None]:
+    """Records the duration of a build phase, such as install, prune or squash."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        PHASE_DURATION.labels(target=target, phase=phase).observe(
+            time.monotonic() - start
+        )
+
+
+@contextmanager
+def measure_installer(target: str, phase: str, installer: str) -> Iterator[None]:
+    """Records the duration of a build phase run by an installer backend."""
+    start = time.monotonic()
+    try:
+        with measure_phase(target, phase):
+            yield
+    finally:
+        INSTALLER_DURATION.labels(
+            target=target, installer=installer, phase=phase
+        ).observe(time.monotonic() - start)
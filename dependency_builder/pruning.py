@@ -0,0 +1,167 @@
+"""
+Removal of the files of the installed trees that are never used at runtime: tests,
+docs, type stubs, source maps, build sources... before squashing them.
+"""
+import fnmatch
+import os
+import shutil
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class Pruning(str, Enum):
+    """How much of the installed trees is removed."""
+
+    none = "none"
+    # Files that packages cannot load at runtime
+    safe = "safe"
+    # Also tests, docs, examples, licenses and C headers, that some packages read
+    aggressive = "aggressive"
+
+
+# Lowercase patterns of the names of the files removed, and of the directories removed
+# with all their content when they end with a slash. The aggressive rules extend the
+# safe ones.
+PRUNING_RULES: Dict[str, Dict[Pruning, Tuple[str, ...]]] = {
+    "python": {
+        Pruning.safe: (
+            # Type stubs and Cython sources of the compiled extensions
+            "*.pyi",
+            "*.pyx",
+            "*.pxd",
+            "*.pxi",
+            # Windows launchers of setuptools
+            "*.exe",
+        ),
+        Pruning.aggressive: (
+            # C sources and headers, that JIT compilers (cupy, torch.utils.cpp_extension)
+            # and cffi declarations read at runtime
+            "*.c",
+            "*.cpp",
+            "*.h",
+            "*.hpp",
+            "tests/",
+            "test/",
+            "docs/",
+            "doc/",
+            "examples/",
+            "*.md",
+            "*.rst",
+            "license*",
+            "licence*",
+            "copying*",
+            "authors*",
+        ),
+    },
+    "nodejs": {
+        Pruning.safe: (
+            # Source maps and type declarations
+            "*.map",
+            "*.d.ts",
+            "*.d.mts",
+            "*.d.cts",
+            "*.tsbuildinfo",
+            "changelog*",
+            "history*",
+            # Development configuration and caches
+            ".github/",
+            ".cache/",
+            ".nyc_output/",
+            ".npmignore",
+            ".travis.yml",
+            ".editorconfig",
+            ".eslintrc*",
+            ".prettierrc*",
+            ".nycrc*",
+        ),
+        Pruning.aggressive: (
+            "test/",
+            "tests/",
+            "__tests__/",
+            "docs/",
+            "doc/",
+            "example/",
+            "examples/",
+            "coverage/",
+            "readme*",
+            "*.md",
+            "*.markdown",
+            "license*",
+            "licence*",
+            # TypeScript sources, the compiled JavaScript is shipped next to them
+            "*.ts",
+            "*.mts",
+            "*.cts",
+        ),
+    },
+}
+# Code files are never removed, whatever their name
+KEPT_SUFFIXES: Dict[str, Tuple[str, ...]] = {
+    "python": (".py", ".so"),
+    "nodejs": (".js", ".cjs", ".mjs", ".json", ".node"),
+}
+
+
+@dataclass
+class PruningReport:
+    files: int = 0
+    bytes: int = 0
+
+
+def matches(name: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def tree_size(path: Path) -> Tuple[int, int]:
+    """Number of files and bytes of a directory, without following symlinks."""
+    files = size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.lstat(os.path.join(root, name)).st_size
+    return files, size
+
+
+def prune(
+    path: Path, ecosystem: str, pruning: Pruning, extra_patterns: List[str]
+) -> PruningReport:
+    """Removes the files and directories of a tree matching the rules of a pruning level.
+
+    `extra_patterns` extend the rules of the safe and aggressive levels.
+    """
+    patterns: List[str] = []
+    if pruning != Pruning.none:
+        patterns.extend(extra_patterns)
+        patterns.extend(PRUNING_RULES[ecosystem][Pruning.safe])
+    if pruning == Pruning.aggressive:
+        patterns.extend(PRUNING_RULES[ecosystem][Pruning.aggressive])
+    patterns = [pattern.lower() for pattern in patterns]
+    file_patterns = [pattern for pattern in patterns if not pattern.endswith("/")]
+    directory_patterns = [pattern[:-1] for pattern in patterns if pattern.endswith("/")]
+    kept_suffixes = KEPT_SUFFIXES[ecosystem]
+
+    report = PruningReport()
+    for root, directories, files in os.walk(path):
+        for name in list(directories):
+            directory = os.path.join(root, name)
+            if not os.path.islink(directory) and matches(
+                name.lower(), directory_patterns
+            ):
+                files_removed, bytes_removed = tree_size(Path(directory))
+                shutil.rmtree(directory)
+                directories.remove(name)
+                report.files += files_removed
+                report.bytes += bytes_removed
+        for name in files:
+            lower_name = name.lower()
+            if lower_name.endswith(kept_suffixes) or not matches(
+                lower_name, file_patterns
+            ):
+                continue
+            file = os.path.join(root, name)
+            report.bytes += os.lstat(file).st_size
+            report.files += 1
+            os.unlink(file)
+    return report
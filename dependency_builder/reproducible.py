@@ -0,0 +1,18 @@
+"""
+Normalization of the volume directories, so that the same dependencies always give
+the same squashfs image, and thus the same CID, whatever the builder node.
+"""
+import os
+from pathlib import Path
+
+# Modification time of every file of the reproducible volumes
+SOURCE_DATE_EPOCH = 0
+
+
+def normalize_timestamps(path: Path) -> None:
+    """Sets the access and modification times of a whole tree to SOURCE_DATE_EPOCH."""
+    times = (SOURCE_DATE_EPOCH, SOURCE_DATE_EPOCH)
+    for root, directories, files in os.walk(path):
+        for name in directories + files:
+            os.utime(os.path.join(root, name), times, follow_symlinks=False)
+    os.utime(path, times)
@@ -0,0 +1,84 @@
+from dataclasses import dataclass, replace
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from conf import settings
+from reproducible import SOURCE_DATE_EPOCH
+
+
+class Compression(str, Enum):
+    """Named sets of mksquashfs options, trading build CPU against image size and read speed."""
+
+    default = "default"
+    fast_build = "fast-build"
+    small_upload = "small-upload"
+    fast_read = "fast-read"
+
+
+@dataclass(frozen=True)
+class CompressionProfile:
+    # None keeps the mksquashfs default (gzip, 128K blocks)
+    compressor: Optional[str] = None
+    block_size: Optional[str] = None
+    compressor_options: Tuple[str, ...] = ()
+    # Detect duplicate files and store them once
+    duplicates: bool = True
+
+    def mksquashfs_options(self, processors: Optional[int] = None) -> str:
+        options = []
+        if self.compressor:
+            options.append(f"-comp {self.compressor}")
+            options.extend(self.compressor_options)
+        if self.block_size:
+            options.append(f"-b {self.block_size}")
+        if not self.duplicates:
+            options.append("-no-duplicates")
+        if processors:
+            options.append(f"-processors {processors}")
+        return " ".join(options)
+
+
+COMPRESSION_PROFILES: Dict[Compression, CompressionProfile] = {
+    Compression.default: CompressionProfile(),
+    # Cheapest compression, larger images
+    Compression.fast_build: CompressionProfile(
+        compressor="lz4", block_size="128K", duplicates=False
+    ),
+    # Slowest compression with the largest blocks, smallest images
+    Compression.small_upload: CompressionProfile(
+        compressor="xz", block_size="1M", compressor_options=("-Xdict-size 100%",)
+    ),
+    # Slower compression, but the fastest decompression in the VMs
+    Compression.fast_read: CompressionProfile(
+        compressor="lz4", block_size="128K", compressor_options=("-Xhc",)
+    ),
+}
+
+
+# Files owned by root and no extended attributes, the creation time of the image
+# is set with SOURCE_DATE_EPOCH. mksquashfs sorts the entries of the directories.
+REPRODUCIBLE_OPTIONS = "-all-root -no-xattrs"
+
+
+def mksquashfs_command(
+    source: Path,
+    destination: Path,
+    compression: Compression,
+    duplicates: bool = True,
+    reproducible: bool = False,
+    fragments: bool = True,
+) -> str:
+    profile = COMPRESSION_PROFILES[compression]
+    if not duplicates:
+        profile = replace(profile, duplicates=False)
+    options = profile.mksquashfs_options(settings.SQUASHFS_PROCESSORS)
+    if not fragments:
+        # The ends of the files are not packed together, each file is stored contiguously
+        options += " -no-fragments"
+    if reproducible:
+        return (
+            f"SOURCE_DATE_EPOCH={SOURCE_DATE_EPOCH} mksquashfs {str(source)} "
+            f"{str(destination)} {options} {REPRODUCIBLE_OPTIONS}"
+        )
+    return f"mksquashfs {str(source)} {str(destination)} {options}".rstrip()
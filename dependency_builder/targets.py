@@ -0,0 +1,95 @@
+"""
+Runtimes the volumes are built for, part of the build cache key. `python3.9` and
+`nodejs` are the runtimes of the Aleph VMs. Matrix builds can also target other Python
+versions and wheel platforms, e.g. `python3.11` or `python3.11-manylinux2014_aarch64`,
+and other Node.js versions, e.g. `nodejs18`.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from conf import settings
+
+PYTHON_TARGET = "python3.9"
+NODEJS_TARGET = "nodejs"
+# Interpreter of the builder, that the packages of PYTHON_TARGET are installed with
+PYTHON_VERSION = "3.9"
+PYTHON_INTERPRETER = f"python{PYTHON_VERSION}"
+
+TARGET_PATTERN = re.compile(
+    r"python(?P<python>3\.\d+)(?:-(?P<platform>[a-z0-9_]+))?|nodejs(?P<nodejs>\d+)?"
+)
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str
+    # Pruning rules of the volumes, python or nodejs
+    ecosystem: str
+    # Python X.Y version, or Node.js major version. None for the Node.js of the VMs.
+    version: Optional[str] = None
+    # Wheel platform tag of Python targets, the one of the builder when None
+    platform: Optional[str] = None
+
+    @property
+    def native(self) -> bool:
+        """Whether the package managers install for their own runtime."""
+        if self.ecosystem == "python":
+            return self.version == PYTHON_VERSION and self.platform is None
+        return self.version is None
+
+    @property
+    def interpreter(self) -> str:
+        """Python interpreter of the target, that its bytecode is compiled with."""
+        return f"python{self.version}"
+
+    def npm_environment(self) -> str:
+        """Environment of npm, so that native addons and engine checks are for the
+        Node.js version of the target."""
+        if self.native:
+            return ""
+        version = settings.MATRIX_NODEJS_VERSIONS[self.version]
+        return f"npm_config_target={version} npm_config_node_version={version} "
+
+
+@lru_cache()
+def parse_target(name: str) -> Target:
+    """Target of a name, raises a ValueError if it is invalid or not supported."""
+    match = TARGET_PATTERN.fullmatch(name)
+    if not match:
+        raise ValueError(f"Invalid target {name}")
+    if match["nodejs"] is not None or name == NODEJS_TARGET:
+        target = Target(name, "nodejs", match["nodejs"])
+        if not target.native and target.version not in settings.MATRIX_NODEJS_VERSIONS:
+            raise ValueError(f"Unsupported Node.js version {target.version}")
+        return target
+    target = Target(name, "python", match["python"], match["platform"])
+    if not target.native:
+        if target.version not in settings.MATRIX_PYTHON_VERSIONS:
+            raise ValueError(f"Unsupported Python version {target.version}")
+        if target.platform and target.platform not in settings.MATRIX_PYTHON_PLATFORMS:
+            raise ValueError(f"Unsupported platform {target.platform}")
+    return target
+
+
+def matrix_targets(names: List[str], ecosystem: str) -> List[str]:
+    """Distinct targets of a matrix build, in the order given."""
+    names = list(dict.fromkeys(names))
+    if not names or len(names) > settings.MATRIX_MAX_TARGETS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Matrix builds take 1 to {settings.MATRIX_MAX_TARGETS} targets",
+        )
+    for name in names:
+        try:
+            target = parse_target(name)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if target.ecosystem != ecosystem:
+            raise HTTPException(
+                status_code=422, detail=f"{name} is not a {ecosystem} target"
+            )
+    return names
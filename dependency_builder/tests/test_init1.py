@@ -0,0 +1,77 @@
+import asyncio
+import os
+import socket
+import threading
+import tracemalloc
+
+import msgpack
+import pytest
+
+import init1
+
+CONFIG = {
+    "input_data": os.urandom(10 * 1024**2),
+    "interface": "asgi",
+    "vm_hash": "0" * 64,
+    "code": os.urandom(10 * 1024**2),
+    "encoding": "zip",
+    "entrypoint": "main:app",
+    "volumes": [{"mount": "/opt/packages", "device": "vdc", "read_only": True}],
+    "variables": {"ALEPH_INIT_HTTP_TIMEOUT": "5"},
+}
+
+
+def test_load_configuration():
+    config = init1.load_configuration(msgpack.dumps(CONFIG))
+    assert config.code == CONFIG["code"]
+    assert config.input_data == CONFIG["input_data"]
+    assert config.volumes == [
+        init1.Volume(mount="/opt/packages", device="vdc", read_only=True)
+    ]
+    assert config.variables == CONFIG["variables"]
+    assert (config.vm_hash, config.entrypoint) == ("0" * 64, "main:app")
+
+
+def test_receive_config_peak_memory():
+    payload = msgpack.dumps(CONFIG)
+    host, guest = socket.socketpair()
+    sender = threading.Thread(
+        target=host.sendall, args=(f"{len(payload)}\n".encode() + payload,)
+    )
+    tracemalloc.start()
+    try:
+        sender.start()
+        config = init1.receive_config(guest)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        sender.join()
+        host.close()
+        guest.close()
+
+    # Code and input data are views of the receive buffer, not copies of it
+    assert isinstance(config.code, memoryview)
+    assert config.code == CONFIG["code"]
+    assert peak < len(payload) + 1024**2
+
+
+def read_instruction(data: bytes, max_size: int):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await init1.read_instruction(reader, max_size)
+
+    return asyncio.run(read())
+
+
+def test_read_instruction():
+    instruction = msgpack.dumps({"scope": {"type": "http"}})
+    framed = f"{len(instruction)}\n".encode() + instruction
+    assert read_instruction(framed, 1024) == (instruction, True)
+    assert read_instruction(b"halt", 1024) == (b"halt", False)
+
+
+def test_read_instruction_too_large():
+    with pytest.raises(init1.InstructionTooLarge):
+        read_instruction(b"9999999999999999999\n{}", 1024)
@@ -0,0 +1,35 @@
+import shlex
+from pathlib import Path
+
+from installers import PythonInstaller, UvPythonInstaller, requirement_arguments
+from targets import parse_target
+
+
+def test_requirement_arguments():
+    arguments = requirement_arguments(
+        [
+            "--extra-index-url https://example.com/simple",
+            "-e git+https://example.com/foo.git#egg=foo",
+            'foo>=1.0 ; python_version < "3.11"',
+        ]
+    )
+    # As the shell passes them
+    assert shlex.split(" ".join(arguments)) == [
+        "--extra-index-url",
+        "https://example.com/simple",
+        "-e",
+        "git+https://example.com/foo.git#egg=foo",
+        'foo>=1.0 ; python_version < "3.11"',
+    ]
+
+
+def test_option_lines_reach_the_install_command_as_arguments():
+    lines = ["--extra-index-url https://example.com/simple", "requests==2.31"]
+    for installer in (PythonInstaller, UvPythonInstaller):
+        command = installer(parse_target("python3.9")).install_command(
+            Path("/volume"), requirement_arguments(lines)
+        )
+        arguments = shlex.split(command)
+        index = arguments.index("--extra-index-url")
+        assert arguments[index + 1] == "https://example.com/simple"
+        assert "requests==2.31" in arguments
@@ -0,0 +1,64 @@
+import pytest
+from packaging.requirements import Requirement
+
+from manifests import normalize_requirement, normalize_requirements, requirement_lines
+
+
+@pytest.mark.parametrize(
+    "line, normalized",
+    [
+        ("Requests == 2.31.0", "requests==2.31"),
+        ("requests>=2.0,<3.0", "requests<3,>=2"),
+        ("Flask_Cors", "flask-cors"),
+        ("uvicorn[Standard,http2]", "uvicorn[http2,standard]"),
+        ("foo==1.0.*", "foo==1.0.*"),
+        ("foo===1.0.0", "foo===1.0.0"),
+        ('foo>=1.0.0; python_version < "3.11"', 'foo>=1 ; python_version < "3.11"'),
+        (
+            "foo @ https://example.com/foo-1.0.tar.gz",
+            "foo @ https://example.com/foo-1.0.tar.gz",
+        ),
+    ],
+)
+def test_normalize_requirement(line, normalized):
+    assert normalize_requirement(line) == normalized
+
+
+@pytest.mark.parametrize(
+    "line, normalized",
+    [
+        ("Django~=4.2.0", "django~=4.2.0"),
+        ("Django~=4.2", "django~=4.2"),
+        ("foo~=2.0", "foo~=2.0"),
+    ],
+)
+def test_normalize_compatible_release(line, normalized):
+    assert normalize_requirement(line) == normalized
+    # Still a valid requirement, that allows the same versions
+    assert Requirement(normalized).specifier == Requirement(line).specifier
+
+
+def test_normalize_requirement_keeps_options_and_invalid_lines():
+    assert normalize_requirement("  --index-url https://example.com  ") == (
+        "--index-url https://example.com"
+    )
+    assert normalize_requirement("not a requirement!") == "not a requirement!"
+
+
+def test_normalize_requirements():
+    lines = [
+        "# Comment",
+        "",
+        "Requests==2.31.0  # inline comment",
+        "requests == 2.31",
+        "foo @ https://example.com/foo.tar.gz#egg=foo",
+    ]
+    assert normalize_requirements(lines) == [
+        "foo @ https://example.com/foo.tar.gz#egg=foo",
+        "requests==2.31",
+    ]
+
+
+def test_requirement_lines():
+    lines = ["# Comment", "", "  Requests==2.31.0  # inline comment", "Django~=4.2.0"]
+    assert requirement_lines(lines) == ["Requests==2.31.0", "Django~=4.2.0"]
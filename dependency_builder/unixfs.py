@@ -0,0 +1,112 @@
+"""
+Computes the CID that `ipfs add` gives to a file with its default settings, without
+uploading it: CIDv0, 256 KiB chunks, balanced DAG of dag-pb UnixFS nodes.
+"""
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple
+
+from utils import CID
+
+CHUNK_SIZE = 256 * 1024
+# Links per node of the balanced DAG
+MAX_LINKS = 174
+# UnixFS node types
+FILE = 2
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+class DagNode(NamedTuple):
+    multihash: bytes
+    # Bytes of the file under this node
+    file_size: int
+    # Bytes of the serialized nodes of this subtree
+    tree_size: int
+
+
+def varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def varint_field(number: int, value: int) -> bytes:
+    return varint(number << 3) + varint(value)
+
+
+def bytes_field(number: int, value: bytes) -> bytes:
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def base58(data: bytes) -> str:
+    number = int.from_bytes(data, "big")
+    encoded = ""
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    leading_zeros = len(data) - len(data.lstrip(b"\0"))
+    return BASE58_ALPHABET[0] * leading_zeros + encoded
+
+
+def sha256_multihash(block: bytes) -> bytes:
+    return b"\x12\x20" + hashlib.sha256(block).digest()
+
+
+def dag_node(unixfs_data: bytes, links: List[DagNode], file_size: int) -> DagNode:
+    # dag-pb puts the links before the data, and go-ipfs always writes their name
+    block = b"".join(
+        bytes_field(
+            2,
+            bytes_field(1, link.multihash)
+            + bytes_field(2, b"")
+            + varint_field(3, link.tree_size),
+        )
+        for link in links
+    ) + bytes_field(1, unixfs_data)
+    return DagNode(
+        multihash=sha256_multihash(block),
+        file_size=file_size,
+        tree_size=len(block) + sum(link.tree_size for link in links),
+    )
+
+
+def leaf_node(chunk: bytes) -> DagNode:
+    unixfs_data = varint_field(1, FILE)
+    if chunk:
+        unixfs_data += bytes_field(2, chunk)
+    unixfs_data += varint_field(3, len(chunk))
+    return dag_node(unixfs_data, [], len(chunk))
+
+
+def parent_node(children: List[DagNode]) -> DagNode:
+    file_size = sum(child.file_size for child in children)
+    unixfs_data = varint_field(1, FILE) + varint_field(3, file_size)
+    for child in children:
+        unixfs_data += varint_field(4, child.file_size)
+    return dag_node(unixfs_data, children, file_size)
+
+
+def stream_cid(stream: BinaryIO) -> CID:
+    nodes = [leaf_node(chunk) for chunk in iter(lambda: stream.read(CHUNK_SIZE), b"")]
+    if not nodes:
+        nodes = [leaf_node(b"")]
+    # Filling each node before starting the next one gives the balanced layout
+    while len(nodes) > 1:
+        nodes = [
+            parent_node(nodes[start : start + MAX_LINKS])
+            for start in range(0, len(nodes), MAX_LINKS)
+        ]
+    return CID(base58(nodes[0].multihash))
+
+
+def file_cid(path: Path) -> CID:
+    """CID of a file as uploaded with `ipfs add` and the default settings."""
+    with open(path, "rb") as stream:
+        return stream_cid(stream)
@@ -0,0 +1,74 @@
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Uploaded files are read by chunks of this size, yielding to the event loop between them
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class MaxBodySizeMiddleware:
+    """Rejects requests with a body larger than `max_size`.
+
+    Requests announcing a larger body are rejected before receiving it, the others,
+    chunked ones included, as soon as more than `max_size` bytes were received.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    @property
+    def detail(self) -> str:
+        return f"Request body larger than {self.max_size} bytes"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse({"detail": self.detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # Turned into a response by the exception handlers of the app
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+
+async def read_upload(data_file: UploadFile, max_size: int) -> str:
+    """Reads an uploaded text file without blocking the event loop.
+
+    Fails if the file is larger than `max_size` bytes, whatever the request announced.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = await data_file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{data_file.filename} is larger than {max_size} bytes",
+            )
+        chunks.append(chunk)
+    try:
+        return b"".join(chunks).decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{data_file.filename} is not a UTF-8 text file",
+        )
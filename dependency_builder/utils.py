@@ -1,30 +1,112 @@
 import asyncio
 import hashlib
 import logging
-import shutil
+import os
+import resource
+import signal
 import subprocess
+from collections import deque
+from contextvars import ContextVar
 from pathlib import Path
-from typing import List, NewType
-
-import aioipfs
-from fastapi import HTTPException
+from typing import Callable, Deque, List, NewType, Optional
 
 Multiaddr = NewType("Multiaddr", str)
 CID = NewType("CID", str)
 
+# Lines of stdout and stderr kept in memory for every subprocess, and their maximum length
+OUTPUT_LINES = 1000
+OUTPUT_LINE_LENGTH = 4096
+
+
+LogSink = Callable[[str], None]
+
+# Receives the output lines of the subprocesses run in the current context, if set
+build_log: ContextVar[Optional[LogSink]] = ContextVar("build_log", default=None)
+
+
+async def read_lines(stream: asyncio.StreamReader, lines: Deque[str]) -> None:
+    """Reads a subprocess output line by line, forwarding the lines to the build log.
+
+    Only the last lines are kept in `lines`, a bounded deque.
+    """
+    sink = build_log.get()
+    while True:
+        try:
+            raw_line = await stream.readline()
+        except ValueError:
+            # Line longer than the stream limit, dropped by the reader
+            raw_line = b"[line too long, truncated]\n"
+        if not raw_line:
+            break
+        line = raw_line[:OUTPUT_LINE_LENGTH].decode("utf-8", errors="replace")
+        lines.append(line if line.endswith("\n") else line + "\n")
+        if sink:
+            sink(line.rstrip("\n"))
+
+
+def limit_cpu_time(seconds: int) -> Callable[[], None]:
+    """Makes a child process and its own children get killed past `seconds` of CPU time."""
+
+    def set_limit():
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 5))
+
+    return set_limit
+
+
+def kill_process_group(proc: asyncio.subprocess.Process) -> None:
+    """Kills a subprocess started in its own session, along with all its children."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
 
 async def run_subprocess(
-    cmd: str, logger: logging.Logger = logging.getLogger(__name__)
+    cmd: str,
+    logger: logging.Logger = logging.getLogger(__name__),
+    timeout: Optional[float] = None,
+    cpu_limit: Optional[int] = None,
+    output_lines: int = OUTPUT_LINES,
 ) -> (str, str, int):
-    """Runs a subprocess and awaits its result."""
-    logger.debug("[COMMAND]", cmd)
+    """Runs a subprocess and awaits its result.
+
+    The whole process group of the subprocess is killed if it runs for more than
+    `timeout` seconds, raising `subprocess.TimeoutExpired`, or if the caller is
+    cancelled. `cpu_limit` bounds the CPU time of every process it starts. Only the
+    last `output_lines` lines of stdout and stderr are returned.
+    """
+    logger.debug(f"[COMMAND] {cmd}")
     proc = await asyncio.create_subprocess_shell(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        limit=2**20,
+        start_new_session=True,
+        preexec_fn=limit_cpu_time(cpu_limit) if cpu_limit else None,
     )
-    stdout, stderr = await proc.communicate()
+    stdout_lines: Deque[str] = deque(maxlen=output_lines)
+    stderr_lines: Deque[str] = deque(maxlen=output_lines)
+    # Not cancelled by a timeout, it ends by itself once the process group is killed
+    output = asyncio.gather(
+        read_lines(proc.stdout, stdout_lines),
+        read_lines(proc.stderr, stderr_lines),
+        proc.wait(),
+    )
+    try:
+        done, _ = await asyncio.wait({output}, timeout=timeout)
+    except BaseException:
+        kill_process_group(proc)
+        raise
+    if not done:
+        kill_process_group(proc)
+        await output
+        logger.error(f"Command {cmd} timed out after {timeout}s")
+        raise subprocess.TimeoutExpired(
+            cmd, timeout, "".join(stdout_lines), "".join(stderr_lines)
+        )
     return_code = proc.returncode
-    stdout = stdout.decode("utf-8")
-    stderr = stderr.decode("utf-8")
+    stdout = "".join(stdout_lines)
+    stderr = "".join(stderr_lines)
     if return_code != 0:
         logger.error(
             f"Command {cmd} failed with return code {return_code}"
@@ -32,14 +114,7 @@ async def run_subprocess(
             f"stderr: {stderr}"
         )
         raise subprocess.CalledProcessError(return_code, cmd, stderr)
-    logger.debug(
-        "\n[RETURN CODE]",
-        return_code,
-        "\n[STDOUT]",
-        stdout,
-        "\n[STDERR]",
-        stderr,
-    )
+    logger.debug(f"\n[RETURN CODE] {return_code}\n[STDOUT] {stdout}\n[STDERR] {stderr}")
     return stdout, stderr, return_code
 
 
@@ -50,47 +125,11 @@ def make_dependencies_hash(dependencies: List[str]) -> str:
     ).hexdigest()
 
 
-async def upload_sources(
-    path: Path,
-    logger: logging.Logger = logging.getLogger(__name__),
-) -> CID:
-    """Uploads a file to IPFS and returns the StoreMessage."""
-    logger.debug(f"Uploading {path} to IPFS...")
-    try:
-        cid = await upload_files_to_ipfs([path], logger=logger)
-    except Exception as e:
-        raise HTTPException(
-            status_code=502,
-            detail=f"Could not upload {path} to IPFS: {e}",
-        )
-    return cid
-
-
-def raise_no_cid():
-    raise ValueError("Could not obtain a CID")
+async def read_file(path: Path) -> str:
+    """Reads a text file without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, path.read_text)
 
 
-async def upload_files_to_ipfs(
-    files: list[Path],
-    multiaddr: Multiaddr = Multiaddr("/dns6/ipfs-2.aleph.im/tcp/443/https"),
-    logger: logging.Logger = logging.getLogger(__name__),
-) -> CID:
-    client = aioipfs.AsyncIPFS(maddr=multiaddr)
-
-    try:
-        cid = None
-        async for added_file in client.add(*files, recursive=True):
-            logger.debug(
-                f"Uploaded file {added_file['Name']} with CID: {added_file['Hash']}"
-            )
-            cid = added_file["Hash"]
-        # The last CID is the CID of the directory uploaded
-        return cid or raise_no_cid()
-    finally:
-        await client.close()
-
-
-async def save_file(data_file, path):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "wb") as buffer:
-        shutil.copyfileobj(data_file.file, buffer)
+async def write_file(path: Path, content: str) -> None:
+    """Writes a text file without blocking the event loop."""
+    await asyncio.get_running_loop().run_in_executor(None, path.write_text, content)
@@ -0,0 +1,98 @@
+import asyncio
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+
+from conf import settings
+from metrics import QUEUE_WAIT
+
+
+@dataclass
+class Workspace:
+    """Scratch directory owned by a single build."""
+
+    path: Path
+
+    @property
+    def volume_path(self) -> Path:
+        """Directory squashed into the volume."""
+        return self.path / "volume"
+
+    @property
+    def squashfs_path(self) -> Path:
+        return self.path / "volume.squashfs"
+
+
+@asynccontextmanager
+async def build_workspace() -> AsyncIterator[Workspace]:
+    """Creates a workspace for a build and removes it once the build is done."""
+    settings.WORKSPACES_PATH.mkdir(parents=True, exist_ok=True)
+    path = Path(tempfile.mkdtemp(dir=settings.WORKSPACES_PATH))
+    workspace = Workspace(path=path)
+    workspace.volume_path.mkdir()
+    try:
+        yield workspace
+    finally:
+        await asyncio.get_running_loop().run_in_executor(
+            None, shutil.rmtree, path, True
+        )
+
+
+class BuildPool:
+    """Bounds the number of builds running at the same time, queueing the others."""
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.running = 0
+        self.queued = 0
+        # Created lazily to be bound to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Waits for a free build slot, or fails if too many builds are waiting."""
+        if self.semaphore.locked() and self.queued >= self.max_queued:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many builds in progress, retry later",
+            )
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        QUEUE_WAIT.observe(time.monotonic() - start)
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+        }
+
+
+build_pool = BuildPool(
+    max_concurrent=settings.MAX_CONCURRENT_BUILDS,
+    max_queued=settings.MAX_QUEUED_BUILDS,
+)